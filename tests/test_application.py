@@ -4,9 +4,11 @@ import sys
 import threading
 import time
 import unittest
+from io import BytesIO
 from urllib.parse import urlencode
 
 import web
+from web.application import Reloader
 
 data = """
 import web
@@ -136,6 +138,85 @@ class ApplicationTest(unittest.TestCase):
 
         self.assertEqual(app.request("/foo").data, b"foo")
 
+    def test_routing_first_match(self):
+        # fmt: off
+        urls = (
+            "/item/new", "new",
+            "/item/(\\d+)", "item",
+            "/(?P<page>[a-z]+)/(\\d+)", "item",
+            "/(.*)", "catchall",
+            "/never", "new",
+        )
+        # fmt: on
+
+        class new:
+            def GET(self):
+                return "new"
+
+        class item:
+            def GET(self, *args):
+                return "item " + ",".join(args)
+
+        class catchall:
+            def GET(self, path):
+                return "catchall " + path
+
+        app = web.application(urls, locals())
+
+        self.assertEqual(app.request("/item/new").data, b"new")
+        self.assertEqual(app.request("/item/42").data, b"item 42")
+        self.assertEqual(app.request("/page/7").data, b"item page,7")
+        self.assertEqual(app.request("/never").data, b"catchall never")
+
+        app.add_mapping("/extra", "new")
+        self.assertEqual(app.request("/extra").data, b"catchall extra")
+
+        # the mapping can still be modified in place.
+        app.mapping.insert(0, ("/extra", "new"))
+        self.assertEqual(app.request("/extra").data, b"new")
+
+    def test_routing_many_routes(self):
+        urls = []
+        for i in range(500):
+            urls += ["/r%d/(\\d+)" % i, "handler"]
+
+        class handler:
+            def GET(self, n):
+                return web.ctx.path + " " + n
+
+        app = web.application(urls, locals())
+        self.assertEqual(app.request("/r0/1").data, b"/r0/1 1")
+        self.assertEqual(app.request("/r499/2").data, b"/r499/2 2")
+        self.assertEqual(app.request("/r500/2").status, "404 Not Found")
+
+    def test_handler_cache(self):
+        urls = ("/", "hello")
+
+        class hello:
+            def GET(self):
+                return "hello"
+
+        fvars = {"hello": hello}
+        app = web.application(urls, fvars)
+
+        self.assertEqual(app.request("/").data, b"hello")
+        self.assertEqual(app.request("/", method="HEAD").status, "200 OK")
+        self.assertEqual(app.request("/", method="POST").status.split()[0], "405")
+
+        # resolved handlers are cached until a module gets reloaded.
+        class hello2(hello):
+            def GET(self):
+                return "hello2"
+
+        fvars["hello"] = hello2
+        self.assertEqual(app.request("/").data, b"hello")
+        Reloader.generation += 1
+        self.assertEqual(app.request("/").data, b"hello2")
+
+        # the same name in other globals.
+        for cls in [hello, hello2, hello]:
+            self.assertIs(app._find_class("hello", {"hello": cls}), cls)
+
     def test_subdirs(self):
         urls = ("/(.*)", "blog")
 
@@ -271,6 +352,44 @@ class ApplicationTest(unittest.TestCase):
         app.request("/foo")
         assert state.x == 1 and state.y == 2, repr(state)
 
+    def test_processor_chain(self):
+        urls = ("/(.*)", "index")
+
+        class index:
+            def GET(self, path):
+                if path == "error":
+                    raise ValueError(path)
+                elif path == "notfound":
+                    raise web.notfound()
+                return path
+
+        app = web.application(urls, locals())
+        seen = []
+
+        def outer(handler):
+            try:
+                return "outer(" + handler() + ")"
+            except Exception as e:
+                seen.append(type(e))
+                raise
+
+        def inner(handler):
+            return "inner(" + handler() + ")"
+
+        app.add_processor(outer)
+        app.add_processor(inner)
+        self.assertEqual(app.request("/foo").data, b"outer(inner(foo))")
+
+        # errors are converted to internalerror before the outer processors
+        # see them, HTTPErrors go through untouched.
+        self.assertEqual(app.request("/error").status, "500 Internal Server Error")
+        self.assertEqual(app.request("/notfound").status, "404 Not Found")
+        self.assertTrue(all(issubclass(e, web.HTTPError) for e in seen))
+
+        # processors appended to the list directly are picked up too.
+        app.processors.append(lambda handler: "last(" + handler() + ")")
+        self.assertEqual(app.request("/foo").data, b"outer(inner(last(foo)))")
+
     def testUnicodeInput(self):
         urls = ("(/.*)", "foo")
 
@@ -306,6 +425,75 @@ class ApplicationTest(unittest.TestCase):
 
         self.assertEqual(response.data, b"a")
 
+    def test_body_stream(self):
+        urls = ("/stream", "stream", "/into", "into", "/data", "data")
+
+        class stream:
+            def POST(self):
+                return ",".join(c.decode() for c in web.body_stream(chunk_size=4))
+
+        class into:
+            def POST(self):
+                f = BytesIO()
+                size = web.body_into(f, chunk_size=4)
+                return "%d %s" % (size, f.getvalue().decode())
+
+        class data:
+            def POST(self):
+                return web.data()
+
+        app = web.application(urls, locals())
+
+        response = app.request("/stream", method="POST", data="0123456789")
+        self.assertEqual(response.data, b"0123,4567,89")
+
+        response = app.request("/into", method="POST", data="0123456789")
+        self.assertEqual(response.data, b"10 0123456789")
+
+        web.config.max_body_size = 8
+        try:
+            for path in ["/stream", "/into", "/data"]:
+                response = app.request(path, method="POST", data="0123456789")
+                self.assertEqual(response.status, "413 Payload Too Large")
+
+            response = app.request("/data", method="POST", data="01234567")
+            self.assertEqual(response.data, b"01234567")
+        finally:
+            del web.config.max_body_size
+
+    def test_multipart_limits(self):
+        urls = ("/", "upload")
+
+        class upload:
+            def POST(self):
+                i = web.input(file={})
+                out = BytesIO()
+                shutil.copyfileobj(i.file.file, out)
+                return "%s %s" % (i.x, out.getvalue().decode())
+
+        app = web.application(urls, locals())
+
+        data = '--boundary\r\nContent-Disposition: form-data; name="x"\r\n\r\nfoo\r\n--boundary\r\nContent-Disposition: form-data; name="file"; filename="a.txt"\r\nContent-Type: text/plain\r\n\r\n0123456789\r\n--boundary--\r\n'
+        headers = {"Content-Type": "multipart/form-data; boundary=boundary"}
+
+        def post():
+            return app.request("/", method="POST", data=data, headers=headers)
+
+        params = web.config.multipart_parameters
+        try:
+            params.spool_limit = 4
+            response = post()
+            self.assertEqual(response.data, b"foo 0123456789")
+
+            params.part_limit = 1
+            self.assertEqual(post().status, "413 Payload Too Large")
+
+            params.part_limit = None
+            params.partsize_limit = 8
+            self.assertEqual(post().status, "413 Payload Too Large")
+        finally:
+            params.update(spool_limit=None, part_limit=None, partsize_limit=None)
+
     def testCustomNotFound(self):
         urls_a = ("/", "a")
         urls_b = ("/", "b")
@@ -376,6 +564,32 @@ class ApplicationTest(unittest.TestCase):
         app.request("/bar")
         self.assertEqual(x.a, 2)
 
+    def test_ctx(self):
+        urls = ("/(.*)", "index")
+
+        class index:
+            def GET(self, path):
+                ctx = web.ctx
+                return " ".join(
+                    [ctx.home, ctx.realhome, ctx.fullpath, ctx.get("query")]
+                )
+
+        app = web.application(urls, locals())
+        response = app.request("/foo?x=1", env={"SCRIPT_NAME": "/x"})
+        self.assertEqual(
+            response.data,
+            b"http://0.0.0.0:8080/x http://0.0.0.0:8080/x /foo?x=1 ?x=1",
+        )
+
+        # copies of ctx include the values computed on access.
+        def copy(handler):
+            ctx = web.storage(web.ctx)
+            return ctx.homedomain + " " + ctx.fullpath
+
+        app.add_processor(copy)
+        response = app.request("/foo", https=True)
+        self.assertEqual(response.data, b"https://0.0.0.0:8080 /foo")
+
     def test_changequery(self):
         urls = ("/", "index")
 
@@ -393,6 +607,24 @@ class ApplicationTest(unittest.TestCase):
         p = f("/?y=1&y=2&x=2")
         self.assertTrue(p in {b"/?y=1&y=2&x=1", b"/?x=1&y=1&y=2"})
 
+    def test_input_cache(self):
+        urls = ("/", "index")
+
+        class index:
+            def POST(self):
+                i = web.input()
+                i.x = "changed"
+                web.changequery(y=None)
+                parsed = web.ctx._get_input, web.ctx._post_input
+                j = web.input()
+                assert web.ctx._get_input is parsed[0]
+                assert web.ctx._post_input is parsed[1]
+                return "%s %s %s %s" % (i.x, j.x, j.y, web.input(z="0").z)
+
+        app = web.application(urls, locals())
+        response = app.request("/?x=1&y=2", method="POST", data={"z": "3"})
+        self.assertEqual(response.data, b"changed 1 2 3")
+
     def test_setcookie(self):
         urls = ("/", "index")
 
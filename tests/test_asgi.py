@@ -0,0 +1,231 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+import warnings
+
+import web
+
+
+def request(asgiapp, path="/", method="GET", query=b"", body=b"", headers=()):
+    """Calls `asgiapp` with a http request and returns the response."""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 12345),
+        "server": ("0.0.0.0", 8080),
+    }
+    # a list body is sent in several messages.
+    chunks = body if isinstance(body, list) else [body]
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks
+    ]
+    messages[-1]["more_body"] = False
+    response = web.storage(status=None, headers=None, data=b"")
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response.status = message["status"]
+            response.headers = dict(message["headers"])
+        else:
+            response.data += message["body"]
+
+    async def run():
+        await asgiapp(scope, receive, send)
+        return response
+
+    return run()
+
+
+class ASGITest(unittest.TestCase):
+    def test_handlers(self):
+        # fmt: off
+        urls = (
+            "/sync", "sync",
+            "/async/(.*)", "async_",
+            "/iter", "iter_",
+        )
+        # fmt: on
+
+        class sync:
+            def GET(self):
+                web.header("Content-Type", "text/plain")
+                return "sync " + web.input(name="world").name
+
+            def POST(self):
+                return b"post " + web.data()
+
+        class async_:
+            async def GET(self, name):
+                await asyncio.sleep(0)
+                return "async " + name + " " + web.ctx.path
+
+        class iter_:
+            def GET(self):
+                yield "a"
+                yield "b"
+
+        app = web.application(urls, locals())
+        asgiapp = app.asgifunc()
+
+        def run(*a, **kw):
+            return asyncio.run(request(asgiapp, *a, **kw))
+
+        response = run("/sync", query=b"name=web")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers[b"Content-Type"], b"text/plain")
+        self.assertEqual(response.data, b"sync web")
+
+        response = run("/sync", method="POST", body=b"x=1")
+        self.assertEqual(response.data, b"post x=1")
+
+        self.assertEqual(run("/async/foo").data, b"async foo /async/foo")
+        self.assertEqual(run("/iter").data, b"ab")
+        self.assertEqual(run("/missing").status, 404)
+
+    def test_body(self):
+        urls = ("/", "index")
+
+        class index:
+            def POST(self):
+                return b"".join(web.body_stream(4))
+
+        app = web.application(urls, locals())
+        asgiapp = app.asgifunc()
+
+        def run(body, headers=()):
+            return asyncio.run(
+                request(asgiapp, method="POST", body=body, headers=headers)
+            )
+
+        self.assertEqual(run([b"abc", b"def"]).data, b"abcdef")
+
+        # big bodies are kept in a temporary file.
+        module = sys.modules["web.application"]
+        module._asgi_spool_size = 4
+        try:
+            self.assertEqual(run([b"abc", b"def"]).data, b"abcdef")
+        finally:
+            module._asgi_spool_size = 1024 * 1024
+
+        web.config.max_body_size = 5
+        try:
+            self.assertEqual(run([b"abc", b"def"]).status, 413)
+            self.assertEqual(run(b"abc", [("Content-Length", "6")]).status, 413)
+            self.assertEqual(run([b"abc", b"de"]).data, b"abcde")
+        finally:
+            del web.config.max_body_size
+
+    def test_thread_local_storage(self):
+        urls = ("/", "index")
+
+        class index:
+            def GET(self):
+                return str("path" in web.ctx.__dict__)
+
+        app = web.application(urls, locals())
+        self.assertEqual(asyncio.run(request(app.asgifunc(), "/")).data, b"False")
+
+        # the other requests keep web.ctx in thread local storage.
+        self.assertEqual(app.request("/").data, b"True")
+
+    def test_concurrent_requests(self):
+        urls = ("/(.*)", "wait")
+        events = {}
+
+        class wait:
+            async def GET(self, name):
+                web.ctx.name = name
+                await events[name].wait()
+                if name == "a":
+                    raise web.notfound()
+                return web.ctx.name + " " + web.ctx.path
+
+        app = web.application(urls, locals())
+        # the handlers wait without holding the thread.
+        asgiapp = app.asgifunc(max_workers=1)
+
+        async def main():
+            events["a"], events["b"] = asyncio.Event(), asyncio.Event()
+            a = asyncio.ensure_future(request(asgiapp, "/a"))
+            b = asyncio.ensure_future(request(asgiapp, "/b"))
+            await asyncio.sleep(0.1)
+            events["b"].set()
+            await asyncio.sleep(0.1)
+            events["a"].set()
+            return await a, await b
+
+        a, b = asyncio.run(main())
+        self.assertEqual(a.status, 404)
+        self.assertEqual(b.status, 200)
+        self.assertEqual(b.data, b"b /b")
+
+    def test_processors(self):
+        urls = ("/(.*)", "handler")
+        log = []
+
+        class handler:
+            async def GET(self, name):
+                await asyncio.sleep(0)
+                log.append("handler " + web.ctx.path)
+                if name == "error":
+                    raise ValueError(name)
+                return name
+
+        def processor(handler):
+            log.append("enter")
+            try:
+                return handler()
+            except web.HTTPError:
+                log.append("error")
+                raise
+            finally:
+                log.append("exit")
+
+        app = web.application(urls, locals())
+        app.add_processor(processor)
+        asgiapp = app.asgifunc()
+
+        # the processor holds a thread while the handler runs.
+        with self.assertWarnsRegex(RuntimeWarning, "processor"):
+            response = asyncio.run(request(asgiapp, "/ok"))
+        self.assertEqual(response.data, b"ok")
+        self.assertEqual(log, ["enter", "handler /ok", "exit"])
+
+        del log[:]
+        with self.assertWarns(RuntimeWarning):
+            response = asyncio.run(request(asgiapp, "/error"))
+        self.assertEqual(response.status, 500)
+        self.assertEqual(log, ["enter", "handler /error", "error", "exit"])
+
+    def test_session(self):
+        urls = ("/", "count")
+
+        class count:
+            async def GET(self):
+                await asyncio.sleep(0)
+                session.count = session.get("count", 0) + 1
+                return str(session.count)
+
+        app = web.application(urls, locals())
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        session = web.session.Session(app, web.session.DiskStore(tmpdir.name))
+        asgiapp = app.asgifunc()
+
+        # sessions don't hold a thread while the handler runs.
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            response = asyncio.run(request(asgiapp))
+        self.assertEqual(response.data, b"1")
+
+        # the session has been saved once the handler was done.
+        cookie = response.headers[b"Set-Cookie"].decode().split(";")[0]
+        response = asyncio.run(request(asgiapp, headers=[("Cookie", cookie)]))
+        self.assertEqual(response.data, b"2")
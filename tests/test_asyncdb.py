@@ -0,0 +1,118 @@
+"""Async DB test"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+import web
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+@unittest.skipIf(aiosqlite is None, "requires aiosqlite")
+class AsyncDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = web.async_database(
+            dbn="sqlite", db=os.path.join(self.dir, "webpy.db"), pool_maxsize=2
+        )
+        self.db.printing = False
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_async(self, f):
+        async def run():
+            try:
+                await self.db.query(
+                    "CREATE TABLE person (id integer primary key, name text)"
+                )
+                await f(self.db)
+            finally:
+                await self.db.pool.close()
+
+        asyncio.run(run())
+
+    def test_queries(self):
+        async def f(db):
+            self.assertEqual(await db.insert("person", name="a"), 1)
+            ids = await db.multiple_insert("person", [dict(name="b"), dict(name="c")])
+            self.assertEqual(list(ids), [2, 3])
+            self.assertEqual(await db.update("person", where="id > 1", name="x"), 2)
+            self.assertEqual(
+                await db.delete("person", where="id = $id", vars=dict(id=3)), 1
+            )
+
+            rows = await db.select("person", order="id")
+            self.assertEqual(len(rows), 2)
+            self.assertEqual([row.name for row in rows], ["a", "x"])
+            self.assertEqual((await db.where("person", name="a")).first().id, 1)
+
+            results = await asyncio.gather(
+                *[db.query("SELECT $i AS i", vars=dict(i=i)) for i in range(5)]
+            )
+            self.assertEqual([r.first().i for r in results], list(range(5)))
+            self.assertEqual(db.pool.stats().size, 2)
+
+        self.run_async(f)
+
+    def test_transaction(self):
+        async def count(db):
+            return (await db.query("SELECT COUNT(*) AS n FROM person")).first().n
+
+        async def f(db):
+            async with db.transaction():
+                await db.insert("person", name="a")
+                try:
+                    async with db.transaction():
+                        await db.insert("person", name="b")
+                        raise ValueError()
+                except ValueError:
+                    pass
+            self.assertEqual(await count(db), 1)
+
+            t = await db.transaction()
+            await db.insert("person", name="c")
+            await t.rollback()
+            self.assertEqual(await count(db), 1)
+
+        self.run_async(f)
+
+
+class Connections:
+    """Stand-in for the AsyncDB of an AsyncConnectionPool."""
+
+    keywords = {}
+
+    async def _connect(self, keywords):
+        return object()
+
+    async def _close(self, conn):
+        pass
+
+
+class AsyncConnectionPoolTest(unittest.TestCase):
+    def test_maxsize(self):
+        async def f():
+            pool = web.asyncdb.AsyncConnectionPool(
+                Connections(), maxsize=1, timeout=0.05
+            )
+            conn = await pool.acquire()
+            with self.assertRaises(web.db.PoolTimeout):
+                await pool.acquire()
+
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, loop.create_task, pool.release(conn))
+            self.assertIs(await pool.acquire(timeout=1), conn)
+            stats = pool.stats()
+            self.assertEqual((stats.checkouts, stats.waits, stats.timeouts), (2, 2, 1))
+
+            await pool.release(conn, discard=True)
+            self.assertEqual((pool.stats().size, pool.stats().idle), (0, 0))
+
+        asyncio.run(f())
@@ -1,7 +1,13 @@
 """DB test"""
 
+import array
+import decimal
 import importlib
+import math
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 
 import web
@@ -36,9 +42,11 @@ def requires_module(name):
     return decorator
 
 
-def setup_database(dbname, driver=None, pooling=False):
+def setup_database(dbname, driver=None, pooling=False, **keywords):
     if dbname == "sqlite":
-        db = web.database(dbn=dbname, db="webpy.db", pooling=pooling, driver=driver)
+        db = web.database(
+            dbn=dbname, db="webpy.db", pooling=pooling, driver=driver, **keywords
+        )
     elif dbname == "postgres":
         db = web.database(
             dbn=dbname,
@@ -49,6 +57,7 @@ def setup_database(dbname, driver=None, pooling=False):
             pw=os.getenv("WEBPY_DB_PASSWORD", ""),
             pooling=pooling,
             driver=driver,
+            **keywords,
         )
     else:
         db = web.database(
@@ -60,6 +69,7 @@ def setup_database(dbname, driver=None, pooling=False):
             pw=os.getenv("WEBPY_DB_PASSWORD", ""),
             pooling=pooling,
             driver=driver,
+            **keywords,
         )
 
     db.printing = True
@@ -143,17 +153,40 @@ class DBTest(unittest.TestCase):
         self.assertRows(2)
 
     def testPooling(self):
-        # can't test pooling if DBUtils is not installed
-        try:
-            import dbutils  # noqa: F401
-        except ImportError:
-            return
         db = setup_database(self.dbname, pooling=True)
-        try:
-            self.assertEqual(db.ctx.db.__class__.__module__, "dbutils.pooled_db")
-            db.select("person", limit=1)
-        finally:
-            db.ctx.db.close()
+        db.select("person", limit=1)
+        db.select("person", limit=1)
+        stats = db.pool.stats()
+        self.assertEqual((stats.checkouts, stats.connects), (2, 1))
+        self.assertEqual((stats.size, stats.idle), (1, 1))
+        db.pool.close()
+
+    def test_release_at_request_end(self):
+        db = setup_database(self.dbname, pooling=True, pool_maxsize=1, pool_timeout=1)
+        db.transaction()
+        db.insert("person", False, name="user1")
+
+        # the abandoned transaction is rolled back at the end of the request.
+        web.utils.ThreadedDict.clear_all()
+        self.assertEqual(db.pool.stats().idle, 1)
+        self.assertRows(0)
+        db.pool.close()
+
+    def test_pooled_result_set(self):
+        db = setup_database(self.dbname, pooling=True, pool_maxsize=1, pool_timeout=1)
+        db.multiple_insert("person", [dict(name=str(i)) for i in range(1000)], False)
+        rows = db.select("person")
+        self.assertEqual(rows.first().name, "0")
+
+        # the connection went back to the pool: the rows were read before.
+        thread = threading.Thread(
+            target=db.delete, args=("person",), kwargs={"where": "1=1"}
+        )
+        thread.start()
+        thread.join()
+        self.assertEqual(len(rows.list()), 999)
+        self.assertEqual(db.pool.stats().idle, 1)
+        db.pool.close()
 
     def test_multiple_insert(self):
         db = self.db
@@ -188,10 +221,125 @@ class DBTest(unittest.TestCase):
             ids = db.multiple_insert("mi", values)
             assert list(ids) == [4, 5, 6]
 
+            ids = db.multiple_insert("mi", iter(values), chunk_size=2)
+            assert list(ids) == [7, 8, 9]
+
+    def test_multiple_insert_chunks(self):
+        db = self.db
+        rows = (dict(name=str(i)) for i in range(10))
+        db.multiple_insert("person", rows, seqname=False, chunk_size=3)
+        self.assertRows(10)
+
+        # all the rows are inserted in one transaction
+        rows = [dict(name="a"), dict(email="b")]
+        self.assertRaises(
+            ValueError, db.multiple_insert, "person", rows, seqname=False, chunk_size=1
+        )
+        self.assertRows(10)
+
+        db.supports_multiple_insert = False
+        rows = [dict(name="a"), dict(name="b"), dict(name="c")]
+        db.multiple_insert("person", rows, seqname=False, chunk_size=2)
+        self.assertRows(13)
+
     def test_result_is_true(self):
         self.db.insert("person", False, name="user")
         self.assertEqual(bool(self.db.select("person")), True)
 
+    def test_stream(self):
+        db = self.db
+        names = [str(i) for i in range(10)]
+        db.multiple_insert("person", [dict(name=n) for n in names], seqname=False)
+
+        rows = db.select("person", order="name", stream=3)
+        self.assertEqual(db.ctx.streams, [rows])
+        self.assertEqual([row.name for row in rows], names)
+        self.assertTrue(rows.closed)
+        self.assertEqual(db.ctx.streams, [])
+
+        with db.query("SELECT name FROM person ORDER BY name", stream=True) as rows:
+            self.assertTrue(rows)
+            self.assertEqual(rows.first().name, "0")
+        self.assertTrue(rows.closed)
+        self.assertEqual(db.ctx.streams, [])
+        self.assertFalse(db.select("person", where="name = 'x'", stream=True))
+
+    def test_stream_at_request_end(self):
+        db = setup_database(self.dbname, pooling=True, pool_maxsize=1, pool_timeout=1)
+        db.insert("person", False, name="a")
+        rows = db.select("person", stream=True)
+        self.assertEqual(rows.first().name, "a")
+
+        # queries made while the stream is open are committed on their own.
+        db.insert("person", False, name="b")
+        web.utils.ThreadedDict.clear_all()
+        self.assertTrue(rows.closed)
+        self.assertEqual(db.pool.stats().idle, 1)
+        self.assertRows(2)
+        db.pool.close()
+
+    def test_row_type(self):
+        self.db.insert("person", False, name="a", email="a@example.com")
+        q = "SELECT name, email FROM person"
+
+        self.assertEqual(
+            self.db.query(q, row_type="tuple").list(), [("a", "a@example.com")]
+        )
+        for row_type in ["namedtuple", "slots"]:
+            rows = self.db.query(q, row_type=row_type).list()
+            self.assertEqual(
+                type(rows[0]), type(self.db.query(q, row_type=row_type).first())
+            )
+            self.assertEqual(rows[0].name, "a")
+            self.assertEqual(rows[0]["email"], "a@example.com")
+            self.assertEqual(rows[0].keys(), ["name", "email"])
+            self.assertTrue("name" in rows[0] and "a" not in rows[0])
+
+            # columns named like the methods of the rows can be read as attributes
+            row = self.db.query("SELECT 1 AS keys", row_type=row_type).first()
+            self.assertEqual((row.keys, row["keys"]), (1, 1))
+
+    def test_to_columns(self):
+        names = ["a", "bb", "ccc"]
+        self.db.multiple_insert("person", [dict(name=n) for n in names], seqname=False)
+        q = "SELECT name, LENGTH(name) AS n FROM person ORDER BY name"
+
+        rows = self.db.query(q)
+        rows.batch_size = 2
+        columns = rows.to_columns(use_numpy=False)
+        self.assertEqual(columns.name, names)
+        self.assertEqual(columns.n, array.array("q", [1, 2, 3]))
+        self.assertEqual(list(self.db.query(q).to_columns().n), [1, 2, 3])
+
+        # a NULL makes a column of floats.
+        q = "SELECT CASE WHEN name = 'bb' THEN NULL ELSE LENGTH(name) END AS n"
+        n = self.db.query(q + " FROM person ORDER BY name").to_columns(False).n
+        self.assertEqual((n.typecode, n[0], n[2]), ("d", 1.0, 3.0))
+        self.assertTrue(math.isnan(n[1]))
+
+    def test_query_hooks(self):
+        queries = []
+        self.db.query_hooks.append(queries.append)
+        self.db.n_plus_one_threshold = 2
+        web.ctx.clear()
+
+        # the queries are counted only during requests.
+        self.db.select("person")
+        self.assertNotIn("db_queries", web.ctx)
+        queries.clear()
+        web.ctx.environ = {}
+
+        for name in ["a", "b"]:
+            self.db.select("person", where="name=$name", vars=locals())
+        self.assertEqual(web.ctx.db_queries, 2)
+        self.assertTrue(web.ctx.db_time >= 0)
+        self.assertEqual(list(web.ctx.db_query_counts.values()), [2])
+
+        self.assertEqual(queries[0].query, queries[1].query)
+        self.assertEqual(queries[0].params, 1)
+        self.assertTrue(queries[0].duration >= 0)
+        web.ctx.clear()
+
     def testBoolean(self):
         def t(active):
             name = "name-%s" % active
@@ -279,9 +427,170 @@ class SqliteTest(DBTest):
         # nested transactions does not work with sqlite
         pass
 
-    def testPooling(self):
-        # pooling is not support for sqlite
-        pass
+    def test_multiple_insert_ids(self):
+        db = self.db
+        db.query("CREATE TABLE mi (id INTEGER PRIMARY KEY, v VARCHAR(5))")
+        ids = db.multiple_insert("mi", [dict(id=10, v="a"), dict(id=5, v="b")])
+        self.assertEqual(list(ids), [10, 5])
+
+        ids = db.multiple_insert("mi", [dict(v="c"), dict(v="d")])
+        self.assertEqual(list(ids), [11, 12])
+
+
+class ReparamTest(unittest.TestCase):
+    def test_cache(self):
+        q = "x = $x AND y IN $y"
+        self.assertEqual(web.reparam(q, dict(x=1, y=[2, 3])).values(), [1, 2, 3])
+        self.assertEqual(web.reparam(q, dict(x="a", y=[])).values(), ["a"])
+        self.assertEqual(str(web.reparam(q, dict(x=2, y=[]))), "x = 2 AND y IN ()")
+        self.assertGreater(web.db._parse.cache_info().hits, 0)
+
+
+class StatementCacheTest(unittest.TestCase):
+    def test_select(self):
+        db = web.db.DB(None, {})
+        for id in [1, 2]:
+            q = db.select(
+                "foo", where="id = $id", vars=dict(id=id), limit=5, _test=True
+            )
+            self.assertEqual(q.query(), "SELECT * FROM foo WHERE id = %s LIMIT %s")
+            self.assertEqual(q.values(), [id, 5])
+        self.assertEqual(len(db._statements), 1)
+
+        q = db.where("foo", x=[1, 2], _test=True)
+        self.assertEqual(q.query(), "SELECT * FROM foo WHERE x = (%s, %s)")
+        self.assertEqual(
+            str(db.where("foo", x=[3], _test=True)), "SELECT * FROM foo WHERE x = (3)"
+        )
+
+    def test_update(self):
+        db = web.db.DB(None, {})
+        for x in [1, 2]:
+            q = db.update("foo", where=dict(id=3), x=x, _test=True)
+            self.assertEqual(q.query(), "UPDATE foo SET x = %s WHERE id = %s")
+            self.assertEqual(q.values(), [x, 3])
+
+        q = db.update("foo", where=3, x=web.db.SQLLiteral("NOW()"), _test=True)
+        self.assertEqual(str(q), "UPDATE foo SET x = NOW() WHERE id = 3")
+
+
+class ResultSetTest(unittest.TestCase):
+    def to_columns(self, *batches):
+        rows = [row for batch in batches for row in batch]
+        cursor = web.db._FetchedCursor([("x",)], [(x,) for x in rows], None)
+        result = web.db.ResultSet(cursor)
+        result.batch_size = len(batches[0])
+        return result.to_columns(use_numpy=False).x
+
+    def test_to_columns(self):
+        D = decimal.Decimal
+        self.assertEqual(self.to_columns([1, 2], [3]), array.array("q", [1, 2, 3]))
+        self.assertEqual(
+            self.to_columns([1, 2], [D("2.5")]), array.array("d", [1, 2, 2.5])
+        )
+        self.assertEqual(
+            self.to_columns([D("1.5"), 2.0], [3]), array.array("d", [1.5, 2, 3])
+        )
+
+        column = self.to_columns([None, None], [1, None])
+        self.assertEqual(column.typecode, "d")
+        self.assertEqual([math.isnan(x) for x in column], [True, True, False, True])
+
+        # NULLs and integers of other columns are kept in lists.
+        self.assertEqual(self.to_columns([None, 1], ["a"]), [None, 1.0, "a"])
+        self.assertEqual(self.to_columns([1, 2], [2**63]), [1, 2, 2**63])
+        self.assertEqual(self.to_columns([True, None]), [True, None])
+
+
+@requires_module("sqlite3")
+class RoutingDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        names = ["primary", "replica1", "replica2"]
+        for name in names:
+            db = web.database(dbn="sqlite", db=os.path.join(self.dir, name))
+            db.query("CREATE TABLE t (name text)")
+            db.insert("t", False, name=name)
+
+        self.db = web.database(
+            dbn="sqlite",
+            db=os.path.join(self.dir, "primary"),
+            replicas=[
+                dict(dbn="sqlite", db=os.path.join(self.dir, n)) for n in names[1:]
+            ],
+        )
+        web.utils.ThreadedDict.clear_all()
+
+    def tearDown(self):
+        web.utils.ThreadedDict.clear_all()
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        return self.db.select("t").first().name
+
+    def test_routing(self):
+        self.assertEqual({self.read(), self.read()}, {"replica1", "replica2"})
+        self.assertIn(
+            self.db.query("SELECT * FROM t").first().name, ["replica1", "replica2"]
+        )
+
+        with self.db.transaction():
+            self.assertEqual(self.read(), "primary")
+        self.assertEqual(self.read(), "primary")
+
+        # new request
+        web.utils.ThreadedDict.clear_all()
+        self.assertNotEqual(self.read(), "primary")
+        self.db.update("t", where="1=1", name="updated")
+        self.assertEqual(self.read(), "updated")
+
+    def test_least_busy(self):
+        self.db.routing = "least-busy"
+        self.db._busy[0] = 1
+        self.assertEqual(self.read(), "replica2")
+        self.assertEqual(self.read(), "replica2")
+
+
+@requires_module("sqlite3")
+class ConnectionPoolTest(unittest.TestCase):
+    def connect(self):
+        import sqlite3
+
+        return sqlite3.connect(":memory:", check_same_thread=False)
+
+    def test_maxsize(self):
+        pool = web.db.ConnectionPool(self.connect, maxsize=1, timeout=0.05)
+        conn = pool.acquire()
+        self.assertRaises(web.db.PoolTimeout, pool.acquire)
+
+        threading.Timer(0.05, pool.release, [conn]).start()
+        self.assertIs(pool.acquire(timeout=1), conn)
+        stats = pool.stats()
+        self.assertEqual((stats.checkouts, stats.waits, stats.timeouts), (2, 2, 1))
+
+    def test_eviction(self):
+        pool = web.db.ConnectionPool(self.connect, minsize=1, max_idle=0)
+        conns = [pool.acquire(), pool.acquire()]
+        for conn in conns:
+            pool.release(conn)
+        self.assertEqual(pool.stats().idle, 2)
+        pool.acquire()
+        self.assertEqual(pool.stats().size, 1)
+
+        pool = web.db.ConnectionPool(self.connect, max_age=0)
+        pool.release(pool.acquire())
+        self.assertEqual(pool.stats().size, 0)
+
+    def test_ping(self):
+        pool = web.db.ConnectionPool(self.connect, ping=True)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        pool.release(conn)
+
+        conn.close()
+        self.assertIsNot(pool.acquire(), conn)
+        self.assertEqual(pool.stats().connects, 2)
 
 
 @requires_module("pysqlite2.dbapi2")
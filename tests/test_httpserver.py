@@ -0,0 +1,131 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import wsgiref.util
+
+from web.httpserver import StaticApp, StaticMiddleware
+
+
+class StaticMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        os.mkdir("static")
+        with open("static/hello.txt", "wb") as f:
+            f.write(b"hello, world\n")
+        StaticApp.stat_cache.cache.clear()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+        StaticApp.stat_cache.cache.clear()
+
+    def request(self, path, method="GET", environ=None, **headers):
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"app"]
+
+        app = StaticMiddleware(app)
+        environ = dict(environ or {}, PATH_INFO=path, REQUEST_METHOD=method)
+        environ.update(("HTTP_" + k.upper(), v) for k, v in headers.items())
+        response = {}
+
+        def start_response(status, headers):
+            response["status"] = status
+            response["headers"] = dict(headers)
+
+        data = b"".join(app(environ, start_response))
+        return response["status"], response["headers"], data
+
+    def test_get(self):
+        status, headers, data = self.request("/static/hello.txt")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(data, b"hello, world\n")
+        self.assertEqual(headers["Content-Type"], "text/plain")
+        self.assertEqual(headers["Content-Length"], "13")
+
+        status, _, data = self.request("/static/hello.txt", method="HEAD")
+        self.assertEqual((status, data), ("200 OK", b""))
+
+        status, _, _ = self.request("/static/missing.txt")
+        self.assertEqual(status, "404 File not found")
+        self.assertEqual(self.request("/foo")[2], b"app")
+
+    def test_conditional(self):
+        _, headers, _ = self.request("/static/hello.txt")
+        status, _, data = self.request(
+            "/static/hello.txt", if_none_match=headers["ETag"]
+        )
+        self.assertEqual((status, data), ("304 Not Modified", b""))
+
+        status, _, _ = self.request(
+            "/static/hello.txt", if_modified_since=headers["Last-Modified"]
+        )
+        self.assertEqual(status, "304 Not Modified")
+
+    def test_range(self):
+        status, headers, data = self.request("/static/hello.txt", range="bytes=7-")
+        self.assertEqual(status, "206 Partial Content")
+        self.assertEqual(headers["Content-Range"], "bytes 7-12/13")
+        self.assertEqual(data, b"world\n")
+
+        status, _, data = self.request("/static/hello.txt", range="bytes=-6")
+        self.assertEqual(data, b"world\n")
+
+        status, headers, _ = self.request("/static/hello.txt", range="bytes=20-")
+        self.assertEqual(status, "416 Range Not Satisfiable")
+        self.assertEqual(headers["Content-Range"], "bytes */13")
+
+        status, _, data = self.request("/static/hello.txt", range="bytes=0-1,3-4")
+        self.assertEqual((status, data), ("200 OK", b"hello, world\n"))
+
+    def test_precompressed(self):
+        with open("static/hello.txt.gz", "wb") as f:
+            f.write(gzip.compress(b"hello, world\n"))
+
+        status, headers, data = self.request(
+            "/static/hello.txt", accept_encoding="gzip, deflate"
+        )
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Content-Type"], "text/plain")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(data), b"hello, world\n")
+
+        _, headers, data = self.request("/static/hello.txt", accept_encoding="br")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(data, b"hello, world\n")
+
+    def test_file_wrapper(self):
+        wrapped = []
+
+        def file_wrapper(f, block_size):
+            wrapped.append(f)
+            return wsgiref.util.FileWrapper(f, block_size)
+
+        environ = {"wsgi.file_wrapper": file_wrapper}
+        _, _, data = self.request("/static/hello.txt", environ=environ)
+        self.assertEqual(data, b"hello, world\n")
+        self.assertEqual(len(wrapped), 1)
+
+        # parts of files are read by the app.
+        _, _, data = self.request("/static/hello.txt", environ, range="bytes=7-")
+        self.assertEqual(data, b"world\n")
+        self.assertEqual(len(wrapped), 1)
+
+    def test_changed_file(self):
+        self.request("/static/hello.txt")
+
+        # the headers match the file even while its stat is cached.
+        with open("static/hello.txt", "ab") as f:
+            f.write(b"bye\n")
+        _, headers, data = self.request("/static/hello.txt")
+        self.assertEqual(data, b"hello, world\nbye\n")
+        self.assertEqual(headers["Content-Length"], "17")
+
+        os.remove("static/hello.txt")
+        status, _, _ = self.request("/static/hello.txt")
+        self.assertEqual(status, "404 File not found")
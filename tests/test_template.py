@@ -1,5 +1,10 @@
+import os
+import sys
+import traceback
 import unittest
 
+import pytest
+
 import web
 from web.template import ExpressionNode, Parser, SecurityError, Template
 
@@ -65,6 +70,37 @@ class TemplateTest(unittest.TestCase):
         f = t(template, globals={"item": TestItem()})
         assert repr(f()) == "'<a href=\"/del/12345\">Delete</a>\\n'"
 
+    def test_escape(self):
+        template = "$def with (a, b, c, d)\n$a $b $c $d $:a"
+        f = Template(template, filename="a.html")
+        html = web.SafeHTML("<b>x</b>")
+        self.assertEqual(
+            str(f("<a href='x'>&</a>", 1, 2.5, html)),
+            "&lt;a href=&#39;x&#39;&gt;&amp;&lt;/a&gt; 1 2.5 <b>x</b> <a href='x'>&</a>\n",
+        )
+        self.assertEqual(web.websafe(None), "")
+        self.assertEqual(web.websafe(b'"'), "&quot;")
+
+        # objects with __html__ give their own HTML.
+        class Markup:
+            def __html__(self):
+                return "<i>y</i>"
+
+        self.assertEqual(web.websafe(Markup()), "<i>y</i>")
+        self.assertEqual(
+            str(f(Markup(), 1, 2, html)), "<i>y</i> 1 2 <b>x</b> <i>y</i>\n"
+        )
+
+    def test_merged_lines(self):
+        f = Template("$def with (x)\n<a>\n<b>$x</b>\n${1 / x}\n<c>\n", "a.html")
+        self.assertEqual(str(f(1)), "<a>\n<b>1</b>\n1.0\n<c>\n")
+        try:
+            f(0)
+        except ZeroDivisionError:
+            lineno = traceback.extract_tb(sys.exc_info()[2])[-1].lineno
+        # the code has 4 more lines than the template
+        self.assertEqual(lineno, 4 + 4)
+
     def testImportMustFail(self):
         tpl = "${__import__('os').getpwd()}"
         self.assertRaises(SecurityError, t, tpl)
@@ -139,3 +175,100 @@ class TestRender:
         tmpdir.join("foobar").write("hello")
         render = web.template.render(str(tmpdir))
         assert str(render.foobar()).strip() == "hello"
+
+    def test_bytecode_cache(self, tmpdir):
+        tmpdir.join("hello.html").write("$def with (name)\nhello $name")
+        web.config.template_cache_dir = str(tmpdir.join("cache"))
+        try:
+            render = web.template.render(str(tmpdir))
+            assert str(render.hello("<x>")).strip() == "hello &lt;x&gt;"
+            assert len(tmpdir.join("cache").listdir()) == 1
+
+            tmpdir.join("hello.html").write("$def with (name)\nbye $name")
+            render = web.template.render(str(tmpdir))
+            assert str(render.hello("x")).strip() == "bye x"
+            assert len(tmpdir.join("cache").listdir()) == 2
+
+            # the cache is invalidated by changes of the code generator.
+            cache = web.template.BytecodeCache(str(tmpdir.join("cache")))
+            key = cache.key("text", "hello.html")
+            source_hash = web.template.BytecodeCache._source_hash
+            web.template.BytecodeCache._source_hash = "changed"
+            assert cache.key("text", "hello.html") != key
+            web.template.BytecodeCache._source_hash = source_hash
+        finally:
+            del web.config.template_cache_dir
+
+    def test_precompile(self, tmpdir):
+        tmpdir.mkdir("templates").join("hello.html").write("$def with (name)\nhi $name")
+        tmpdir.join("templates").mkdir("sub").join("bye.html").write("bye")
+        root, out = str(tmpdir.join("templates")), str(tmpdir.join("build"))
+
+        manifest = web.template.precompile_templates(root, out)
+        paths = [
+            os.path.join(root, "hello.html"),
+            os.path.join(root, "sub", "bye.html"),
+        ]
+        assert sorted(manifest["templates"]) == paths
+        cached = sorted(os.listdir(out))
+        assert cached == sorted([*manifest["templates"].values(), "manifest.json"])
+
+        web.config.template_cache_dir = out
+        try:
+            render = web.template.render(root)
+            assert str(render.hello("x")).strip() == "hi x"
+            assert str(render.sub.bye()).strip() == "bye"
+            assert sorted(os.listdir(out)) == cached
+        finally:
+            del web.config.template_cache_dir
+
+        # several directories share the manifest and the cache directory.
+        tmpdir.mkdir("more").join("more.html").write("more")
+        more = str(tmpdir.join("more"))
+        manifest = web.template.precompile_templates([root, more], out)
+        assert list(manifest["templates"]) == [*paths, os.path.join(more, "more.html")]
+        assert len(os.listdir(out)) == len(paths) + 2
+
+        # only the files of the previous manifest are removed.
+        tmpdir.join("templates", "sub", "bye.html").remove()
+        tmpdir.join("build", "a" * 40).write("")
+        manifest = web.template.precompile_templates(root, out)
+        assert sorted(os.listdir(out)) == sorted(
+            [manifest["templates"][paths[0]], "a" * 40, "manifest.json"]
+        )
+
+    def test_main(self, tmpdir, capsys):
+        tmpdir.mkdir("templates").join("hello.html").write("hello")
+        root, out = str(tmpdir.join("templates")), str(tmpdir.join("build"))
+
+        web.template.main(["compile", root, "--out", out])
+        assert capsys.readouterr().out == "1 templates compiled\n"
+        assert sorted(os.listdir(out))[-1] == "manifest.json"
+
+        for args in [[], ["compile", root], ["compile", root, "--out"]]:
+            with pytest.raises(SystemExit) as e:
+                web.template.main(args)
+            assert e.value.code == 2
+
+    def test_stream(self, tmpdir):
+        tmpdir.join("rows.html").write(
+            "$def with (rows)\n<ul>\n$for r in rows:\n    <li>$r</li>\n</ul>"
+        )
+        rows = web.template.render(str(tmpdir)).rows
+        rows.stream_chunk_parts = 6
+
+        chunks = list(rows.stream(["<a>", "b", "c"]))
+        assert chunks == [
+            b"<ul>\n<li>&lt;a&gt;</li>\n<li>b</li>\n",
+            b"<li>c</li>\n</ul>\n",
+        ]
+        assert b"".join(chunks) == str(rows(["<a>", "b", "c"])).encode()
+
+        # templates in a layout and compiled templates give a single chunk.
+        tmpdir.join("layout.html").write("$def with (page)\n<body>$:page</body>")
+        render = web.template.render(str(tmpdir), base="layout")
+        page = b"<body><ul>\n<li>a</li>\n</ul>\n</body>\n"
+        assert list(render.rows.stream(["a"])) == [page]
+
+        compiled = web.template.CompiledTemplate(lambda: "<p>x</p>\n", "x.html")
+        assert list(compiled.stream()) == [b"<p>x</p>\n"]
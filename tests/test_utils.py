@@ -1,3 +1,6 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 from multipart import parse_form_data
@@ -43,8 +46,7 @@ class TestStorify:
     def test_storify_with_a_binary_file_value(self):
         # Prepare some raw multipart data with a binary file attachment
         binary_file_content = b"\x01\x02\x03\x04\x05"
-        raw_data = (
-            b"""--boundary\r
+        raw_data = b"""--boundary\r
 Content-Disposition: form-data; name="field1"\r
 \r
 value1\r
@@ -56,10 +58,7 @@ value2\r
 Content-Disposition: form-data; name="file"; filename="example.bin"\r
 Content-Type: application/octet-stream\r
 \r
-"""
-            + binary_file_content
-            + b"\r\n--boundary--\r\n"
-        )
+""" + binary_file_content + b"\r\n--boundary--\r\n"
 
         # Create a BytesIO object from the raw data
         buffer = BytesIO(raw_data)
@@ -82,3 +81,64 @@ Content-Type: application/octet-stream\r
         # Ensure binary content matches.
         result = utils.storify({"files": file_obj})
         assert result.files == binary_file_content
+
+
+class TestContextValues:
+    def run(self, f):
+        # in a copy of the context, as use_context applies to the whole context.
+        return contextvars.copy_context().run(f)
+
+    def test_threads(self):
+        d = utils.ThreadedDict()
+
+        def f():
+            utils.ThreadedDict.use_context()
+            d.x = 1
+
+            def g():
+                assert "x" not in d
+                d.x = 2
+
+            t = threading.Thread(target=g)
+            t.start()
+            t.join()
+            assert d.x == 1
+
+            # functions run with a copy of the context see the same values.
+            with ThreadPoolExecutor(1) as pool:
+                context = contextvars.copy_context()
+                assert pool.submit(context.run, d.get, "x").result() == 1
+
+        self.run(f)
+
+    def test_clear_all(self):
+        d = utils.ThreadedDict()
+
+        def f():
+            utils.ThreadedDict.use_context()
+            d.x = 1
+            utils.ThreadedDict.clear_all()
+            assert "x" not in d
+            assert d.get("x") is None
+            d["x"] = 2
+            assert dict(d) == {"x": 2}
+            del d.x
+            assert list(d.keys()) == []
+
+        self.run(f)
+
+    def test_use_context(self):
+        d = utils.ThreadedDict()
+
+        def f():
+            utils.ThreadedDict.use_context()
+            assert "x" not in d
+            d.x = 1
+            return d.x
+
+        assert self.run(f) == 1
+
+        # the other contexts keep their values per thread.
+        assert "x" not in d
+        d.x = 2
+        assert d.__dict__ == {"x": 2}
@@ -2,6 +2,7 @@
 """web.py: makes web apps (http://webpy.org)"""
 
 from . import (  # noqa: F401
+    asyncdb,
     db,
     debugerror,
     form,
@@ -15,6 +16,7 @@ from . import (  # noqa: F401
     wsgi,
 )
 from .application import *  # noqa: F401,F403
+from .asyncdb import *  # noqa: F401,F403
 from .db import *  # noqa: F401,F403
 from .debugerror import *  # noqa: F401,F403
 from .http import *  # noqa: F401,F403
@@ -3,21 +3,26 @@ Web application
 (from web.py)
 """
 
+import asyncio
+import contextvars
+import functools
 import itertools
 import os
+import re
 import sys
+import tempfile
 import traceback
+import warnings
 import wsgiref.handlers
+from concurrent.futures import ThreadPoolExecutor
 from importlib import reload
-from inspect import isclass
+from inspect import isawaitable, isclass
 from io import BytesIO
-from urllib.parse import unquote, urlencode, urlparse
+from urllib.parse import urlencode, urlparse
 
 from . import browser, httpserver, utils, wsgi
 from . import webapi as web
 from .debugerror import debugerror
-from .py3helpers import iteritems
-from .utils import lstrips
 
 __all__ = [
     "application",
@@ -51,6 +56,11 @@ class application:
         self.init_mapping(mapping)
         self.fvars = fvars
         self.processors = []
+        self._chain = None
+
+        # handler classes and methods resolved by _delegate, see _get_cache.
+        self._cache = {}
+        self._cache_generation = Reloader.generation
 
         self.add_processor(loadhook(self._load))
         self.add_processor(unloadhook(self._unload))
@@ -125,9 +135,23 @@ class application:
 
     def init_mapping(self, mapping):
         self.mapping = list(utils.group(mapping, 2))
+        self._router = self._make_router(self.mapping)
 
     def add_mapping(self, pattern, classname):
         self.mapping.append((pattern, classname))
+        self._router = self._make_router(self.mapping)
+
+    def _make_router(self, mapping):
+        return Router(mapping)
+
+    def _get_router(self, mapping):
+        router = self._router
+        if router.mapping is not mapping or router.size != len(mapping):
+            # the mapping has been replaced or modified in place.
+            router = self._make_router(mapping)
+            if mapping is self.mapping:
+                self._router = router
+        return router
 
     def add_processor(self, processor):
         """
@@ -147,6 +171,7 @@ class application:
         """
         # PY3DOCTEST: b'hello, web.py'
         self.processors.append(processor)
+        self._build_chain()
 
     def request(
         self,
@@ -267,23 +292,65 @@ class application:
         return self._delegate(fn, self.fvars, args)
 
     def handle_with_processors(self):
-        def process(processors):
-            try:
-                if processors:
-                    p, processors = processors[0], processors[1:]
-                    return p(lambda: process(processors))
-                else:
-                    return self.handle()
-            except web.HTTPError:
-                raise
-            except (KeyboardInterrupt, SystemExit):
-                raise
-            except:
-                print(traceback.format_exc(), file=web.debug)
-                raise self.internalerror()
+        chain = self._chain
+        if (
+            chain is None
+            or chain.processors is not self.processors
+            or chain.size != len(self.processors)
+        ):
+            # processors have been replaced or modified in place.
+            chain = self._build_chain()
+        return chain()
+
+    def _build_chain(self):
+        """Builds the callable that applies all the processors in order
+        and finally calls `handle`. The chain is rebuilt only when the
+        processors change, instead of on every request.
+        """
+
+        def guard(f):
+            def g():
+                try:
+                    return f()
+                except web.HTTPError:
+                    raise
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except:
+                    print(traceback.format_exc(), file=web.debug)
+                    raise self.internalerror()
+
+            return g
+
+        # processors that don't handle awaitable results need to see the whole
+        # coroutine handler run, see asgifunc.
+        blocking = [
+            getattr(p, "__qualname__", None) or repr(p)
+            for p in self.processors
+            if not getattr(p, "async_aware", False)
+        ]
+
+        def handle():
+            result = self.handle()
+            loop = _event_loop.get()
+            if loop is not None and blocking and isawaitable(result):
+                warnings.warn(
+                    "coroutine handlers hold a thread of the pool while they run, "
+                    "as these processors are not async_aware: " + ", ".join(blocking),
+                    RuntimeWarning,
+                )
+                result = asyncio.run_coroutine_threadsafe(_wait(result), loop).result()
+            return result
 
         # processors must be applied in the reverse order. (??)
-        return process(self.processors)
+        chain = guard(handle)
+        for p in reversed(self.processors):
+            chain = guard(functools.partial(p, chain))
+
+        chain.processors = self.processors
+        chain.size = len(self.processors)
+        self._chain = chain
+        return chain
 
     def wsgifunc(self, *middleware):
         """Returns a WSGI-compatible function for this application."""
@@ -343,6 +410,86 @@ class application:
 
         return wsgi
 
+    def asgifunc(self, max_workers=None):
+        """Returns an ASGI application for this application.
+
+        Handler methods can be coroutines, like `async def GET(self)`, which are
+        awaited in the event loop. Processors and other handlers run in a pool
+        of at most `max_workers` threads. `web.ctx`, `web.input()` and
+        `web.data()` work in both, as the ThreadedDicts keep their values per
+        context instead of per thread while handling the requests of this
+        application, see `utils.ThreadedDict.use_context`.
+
+        Processors see the whole coroutine handler run. Processors that handle
+        awaitable results themselves, like those of `loadhook`, `unloadhook`
+        and sessions, have an `async_aware` attribute set to True. If any
+        processor does not, the thread running the processors waits for the
+        handler, so the pool limits the number of requests waiting at once,
+        and a RuntimeWarning says so.
+
+            asgiapp = app.asgifunc()
+
+            $ uvicorn code:asgiapp
+        """
+        pool = ThreadPoolExecutor(max_workers, thread_name_prefix="webpy")
+
+        async def run_sync(f, *args):
+            # the copy of the context shares the values of web.ctx with this task.
+            context = contextvars.copy_context()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                pool, functools.partial(context.run, f, *args)
+            )
+
+        def handle():
+            try:
+                # allow uppercase methods only
+                if web.ctx.method.upper() != web.ctx.method:
+                    raise web.nomethod()
+                return self.handle_with_processors()
+            except web.HTTPError as e:
+                return [e.data]
+
+        async def handle_async(result):
+            try:
+                return await result
+            except web.HTTPError as e:
+                return [e.data]
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                print(traceback.format_exc(), file=web.debug)
+                return [self.internalerror().data]
+
+        async def asgi(scope, receive, send):
+            if scope["type"] == "lifespan":
+                return await _asgi_lifespan(receive, send)
+            elif scope["type"] != "http":
+                raise ValueError("Unsupported ASGI scope type: %s" % scope["type"])
+
+            # start with fresh ThreadedDicts for this request, kept in the
+            # context of its task and shared with the thread pool.
+            utils.ThreadedDict.use_context()
+            env = _asgi_environ(scope)
+            self.load(env)
+            _event_loop.set(asyncio.get_running_loop())
+
+            try:
+                try:
+                    if not await _asgi_body(receive, env):
+                        return  # client disconnected
+                    result = await run_sync(handle)
+                    if isawaitable(result):
+                        result = await handle_async(result)
+                except web.HTTPError as e:
+                    result = [e.data]  # body too large
+                await _asgi_send(send, _asgi_chunks(result, run_sync))
+            finally:
+                env["wsgi.input"].close()
+                self._cleanup()
+
+        return asgi
+
     def run(self, *middleware):
         """
         Starts handling requests. If called in a CGI or FastCGI context, it will follow
@@ -425,64 +572,86 @@ class application:
         """Initializes ctx using env."""
         ctx = web.ctx
         ctx.clear()
-        ctx.status = "200 OK"
-        ctx.headers = []
-        ctx.output = ""
-        ctx.environ = ctx.env = env
-        ctx.host = env.get("HTTP_HOST")
-
-        if env.get("wsgi.url_scheme") in ["http", "https"]:
-            ctx.protocol = env["wsgi.url_scheme"]
-        elif env.get("HTTPS", "").lower() in ["on", "true", "1"]:
-            ctx.protocol = "https"
-        else:
-            ctx.protocol = "http"
-        ctx.homedomain = ctx.protocol + "://" + env.get("HTTP_HOST", "[unknown]")
-        ctx.homepath = os.environ.get("REAL_SCRIPT_NAME", env.get("SCRIPT_NAME", ""))
-        ctx.home = ctx.homedomain + ctx.homepath
-        # @@ home is changed when the request is handled to a sub-application.
-        # @@ but the real home is required for doing absolute redirects.
-        ctx.realhome = ctx.home
-        ctx.ip = env.get("REMOTE_ADDR")
-        ctx.method = env.get("REQUEST_METHOD")
-        try:
-            ctx.path = bytes(env.get("PATH_INFO"), "latin1").decode("utf8")
-        except UnicodeDecodeError:  # If there are Unicode characters...
-            ctx.path = env.get("PATH_INFO")
-
-        # http://trac.lighttpd.net/trac/ticket/406 requires:
-        if env.get("SERVER_SOFTWARE", "").startswith(("lighttpd/", "nginx/")):
-            ctx.path = lstrips(env.get("REQUEST_URI").split("?")[0], ctx.homepath)
-            # Apache and CherryPy webservers unquote urls but lighttpd and nginx do not.
-            # Unquote explicitly for lighttpd and nginx to make ctx.path uniform across
-            # all servers.
-            ctx.path = unquote(ctx.path)
-
-        if env.get("QUERY_STRING"):
-            ctx.query = "?" + env.get("QUERY_STRING", "")
-        else:
-            ctx.query = ""
 
-        ctx.fullpath = ctx.path + ctx.query
-
-        for k, v in iteritems(ctx):
-            # convert all string values to unicode values and replace
+        host, ip, method = (
+            env.get("HTTP_HOST"),
+            env.get("REMOTE_ADDR"),
+            env.get("REQUEST_METHOD"),
+        )
+        if bytes in (type(host), type(ip), type(method)):
+            # convert byte values to unicode values and replace
             # malformed data with a suitable replacement marker.
-            if isinstance(v, bytes):
-                ctx[k] = v.decode("utf-8", "replace")
-
-        # status must always be str
-        ctx.status = "200 OK"
+            host, ip, method = (
+                v.decode("utf-8", "replace") if isinstance(v, bytes) else v
+                for v in (host, ip, method)
+            )
+
+        # homedomain, home, realhome, query and fullpath are computed from the
+        # environ when they are first accessed, see webapi._Context.
+        ctx.update(
+            status="200 OK",
+            headers=[],
+            output="",
+            environ=env,
+            env=env,
+            host=host,
+            protocol=web._env_protocol(env),
+            homepath=web._env_homepath(env),
+            ip=ip,
+            method=method,
+            path=web._env_path(env),
+            app_stack=[],
+        )
 
-        ctx.app_stack = []
+    def _get_cache(self):
+        """Returns the cache of resolved handlers. The cache is emptied
+        whenever the Reloader has reloaded a module since it was filled.
+        """
+        if self._cache_generation != Reloader.generation:
+            self._cache = {}
+            self._cache_generation = Reloader.generation
+        return self._cache
+
+    def _find_method(self, cls, meth):
+        """Returns name of the method of `cls` to call for the HTTP method `meth`."""
+        cache = self._get_cache()
+        key = (cls, meth)
+        if key in cache:
+            return cache[key]
+
+        name = meth
+        if name == "HEAD" and not hasattr(cls, name):
+            name = "GET"
+        if not hasattr(cls, name):
+            # not cached, as the method comes from the client.
+            raise web.nomethod(cls)
+        cache[key] = name
+        return name
+
+    def _find_class(self, f, fvars):
+        """Returns the handler class named `f`, which is either a dotted
+        name to import or a name in `fvars`.
+        """
+        cache = self._get_cache()
+        key = (f, id(fvars))
+        # fvars is kept in the entry, so that its id can't be reused by
+        # another dict while the entry exists.
+        entry = cache.get(key)
+        if entry is not None and entry[0] is fvars:
+            return entry[1]
+
+        if "." in f:
+            mod, cls = f.rsplit(".", 1)
+            mod = __import__(mod, None, None, [""])
+            cls = getattr(mod, cls)
+        else:
+            cls = fvars[f]
+        cache[key] = (fvars, cls)
+        return cls
 
     def _delegate(self, f, fvars, args=[]):
         def handle_class(cls):
-            meth = web.ctx.method
-            if meth == "HEAD" and not hasattr(cls, meth):
-                meth = "GET"
-            if not hasattr(cls, meth):
-                raise web.nomethod(cls)
+            meth = self._find_method(cls, web.ctx.method)
             tocall = getattr(cls(), meth)
             return tocall(*args)
 
@@ -500,34 +669,24 @@ class application:
                     if x:
                         url += "?" + x
                 raise web.redirect(url)
-            elif "." in f:
-                mod, cls = f.rsplit(".", 1)
-                mod = __import__(mod, None, None, [""])
-                cls = getattr(mod, cls)
-            else:
-                cls = fvars[f]
-            return handle_class(cls)
+            return handle_class(self._find_class(f, fvars))
         elif hasattr(f, "__call__"):
             return f()
         else:
             return web.notfound()
 
     def _match(self, mapping, value):
-        for pat, what in mapping:
-            if isinstance(what, application):
-                if value.startswith(pat):
-                    f = lambda: self._delegate_sub_application(pat, what)
-                    return f, None
-                else:
-                    continue
-            elif isinstance(what, str):
-                what, result = utils.re_subm(rf"^{pat}\Z", what, value)
-            else:
-                result = utils.re_compile(rf"^{pat}\Z").match(value)
-
-            if result:  # it's a match
-                return what, [x for x in result.groups()]
-        return None, None
+        router = self._get_router(mapping)
+        pat, what, result = router.match(value)
+        if result is None:
+            return None, None
+        elif isinstance(what, application) and router.subapps:
+            f = lambda: self._delegate_sub_application(pat, what)
+            return f, None
+        elif isinstance(what, str) and "\\" in what:
+            # substitute groups, as in r"redirect /hello/\1"
+            what = result.expand(what)
+        return what, [x for x in result.groups()]
 
     def _delegate_sub_application(self, dir, app):
         """Deletes request to sub application `app` rooted at the directory `dir`.
@@ -568,6 +727,142 @@ class application:
             return web._InternalError()
 
 
+# event loop of the ASGI server handling the current request, see asgifunc.
+_event_loop = contextvars.ContextVar("webpy_event_loop", default=None)
+
+
+async def _wait(awaitable):
+    return await awaitable
+
+
+def _asgi_environ(scope):
+    """Returns a WSGI environ for the ASGI http `scope`, without the request
+    body, see `_asgi_body`.
+    """
+    script_name = scope.get("root_path", "")
+    path = scope["path"]
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name) :]
+
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name.encode("utf-8").decode("latin1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "asgi.scope": scope,
+    }
+    if scope.get("server"):
+        env["SERVER_NAME"] = scope["server"][0]
+        env["SERVER_PORT"] = str(scope["server"][1])
+    if scope.get("client"):
+        env["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ["CONTENT_TYPE", "CONTENT_LENGTH"]:
+            name = "HTTP_" + name
+        value = value.decode("latin1")
+        if name in env:
+            value = env[name] + "," + value
+        env[name] = value
+    return env
+
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+# request bodies bigger than this are kept in a temporary file, see _asgi_body.
+_asgi_spool_size = 1024 * 1024
+
+
+async def _asgi_body(receive, env):
+    """Receives the request body into `env["wsgi.input"]`. Returns False if
+    the client has disconnected.
+
+    Raises `payloadtoolarge` when the body is bigger than `max_body_size`,
+    and keeps bodies bigger than `_asgi_spool_size` in a temporary file.
+    """
+    web._check_body_size(utils.intget(env.get("CONTENT_LENGTH"), 0))
+
+    body = env["wsgi.input"] = tempfile.SpooledTemporaryFile(_asgi_spool_size)
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return False
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        web._check_body_size(size)
+        body.write(chunk)
+        if not message.get("more_body"):
+            break
+
+    body.seek(0)
+    if size and "CONTENT_LENGTH" not in env:
+        env["CONTENT_LENGTH"] = str(size)
+    return True
+
+
+async def _asgi_chunks(result, run_sync):
+    """Yields the response body as bytes. Iterators are advanced using
+    `run_sync` as they may block.
+    """
+
+    def encode(r):
+        return r if isinstance(r, bytes) else str(r).encode("utf-8")
+
+    if hasattr(result, "__aiter__"):
+        async for r in result:
+            yield encode(r)
+    elif result and hasattr(result, "__next__"):
+        done = object()
+        while True:
+            r = await run_sync(next, result, done)
+            if r is done:
+                break
+            yield encode(r)
+    elif isinstance(result, list):
+        for r in result:
+            yield encode(r)
+    else:
+        yield encode(result)
+
+
+async def _asgi_send(send, chunks):
+    # the first chunk is taken before sending the status and headers,
+    # as generators may change them, just like in wsgifunc.
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": int(web.ctx.status.split(" ", 1)[0]),
+            "headers": [
+                (k.encode("latin1"), str(v).encode("latin1"))
+                for k, v in web.ctx.headers
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": first, "more_body": True})
+    async for chunk in chunks:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
 def with_metaclass(mcls):
     def decorator(cls):
         body = vars(cls).copy()
@@ -651,16 +946,10 @@ class subdomain_application(application):
         fn, args = self._match(self.mapping, host)
         return self._delegate(fn, self.fvars, args)
 
-    def _match(self, mapping, value):
-        for pat, what in mapping:
-            if isinstance(what, str):
-                what, result = utils.re_subm("^" + pat + "$", what, value)
-            else:
-                result = utils.re_compile("^" + pat + "$").match(value)
-
-            if result:  # it's a match
-                return what, [x for x in result.groups()]
-        return None, None
+    def _make_router(self, mapping):
+        # hosts are matched with `$` and sub-applications are matched
+        # like any other handler, not by prefix.
+        return Router(mapping, end="$", subapps=False)
 
 
 def loadhook(h):
@@ -677,6 +966,7 @@ def loadhook(h):
         h()
         return handler()
 
+    processor.async_aware = True
     return processor
 
 
@@ -700,10 +990,28 @@ def unloadhook(h):
 
         if result and hasattr(result, "__next__"):
             return wrap(result)
+        elif isawaitable(result):
+            return wrap_awaitable(result)
+        elif hasattr(result, "__aiter__"):
+            return wrap_aiter(result)
         else:
             h()
             return result
 
+    async def wrap_awaitable(result):
+        # result of an async handler, see application.asgifunc
+        try:
+            return await result
+        finally:
+            h()
+
+    async def wrap_aiter(result):
+        try:
+            async for x in result:
+                yield x
+        finally:
+            h()
+
     def wrap(result):
         def next_hook():
             try:
@@ -720,6 +1028,7 @@ def unloadhook(h):
             except StopIteration:
                 return
 
+    processor.async_aware = True
     return processor
 
 
@@ -762,6 +1071,95 @@ def autodelegate(prefix=""):
     return internal
 
 
+class Router:
+    r"""
+    Compiled form of an url mapping.
+
+    Consecutive patterns are combined into a single regular expression, so
+    that finding the handler for a path costs one regex match instead of
+    one per route. The first-match semantics of the mapping are preserved.
+
+        >>> router = Router([("/", "index"), ("/item/(\\d+)", "item")])
+        >>> pat, what, m = router.match("/item/42")
+        >>> what, m.groups()
+        ('item', ('42',))
+        >>> router.match("/missing")
+        (None, None, None)
+
+    Patterns that can't be safely combined with others (those using named
+    groups, backreferences, conditionals or global flags) are matched on
+    their own, in their original position.
+    """
+
+    _isolate = re.compile(r"\\[1-9]|\(\?P|\(\?\(|\(\?[aiLmsux]+\)")
+
+    def __init__(self, mapping, end=r"\Z", subapps=True):
+        self.mapping = mapping
+        self.size = len(mapping)
+        self.end = end
+        self.subapps = subapps
+
+        # list of (combined regex, routes), where routes maps the index of
+        # the group wrapping a pattern to (pat, what, regex).
+        self.chunks = []
+        pending = []
+        for pat, what in mapping:
+            if self.subapps and isinstance(what, application):
+                source = "^" + re.escape(pat)
+            else:
+                source = "^" + pat + end
+
+            if self._isolate.search(source):
+                self._add_chunk(pending)
+                self._add_chunk([(pat, what, source)])
+                pending = []
+            else:
+                pending.append((pat, what, source))
+        self._add_chunk(pending)
+
+    def _add_chunk(self, items):
+        if not items:
+            return
+        elif len(items) > 1:
+            try:
+                self.chunks.append(self._combine(items))
+                return
+            except re.error:
+                # fall back to matching the patterns one by one,
+                # so that the error, if any, shows up at request time.
+                pass
+        for pat, what, source in items:
+            self.chunks.append((None, {0: (pat, what, source)}))
+
+    def _combine(self, items):
+        parts, routes, index = [], {}, 1
+        for pat, what, source in items:
+            regex = re.compile(source)
+            parts.append("(" + source + ")")
+            routes[index] = (pat, what, regex)
+            index += regex.groups + 1
+        return re.compile("|".join(parts)), routes
+
+    def match(self, value):
+        """Returns `(pat, what, match)` for the first route matching `value`
+        or `(None, None, None)` when there is none.
+        """
+        for combined, routes in self.chunks:
+            if combined is None:
+                pat, what, source = routes[0]
+                result = utils.re_compile(source).match(value)
+            else:
+                m = combined.match(value)
+                if m is None:
+                    continue
+                pat, what, regex = routes[m.lastindex]
+                # match again with the pattern alone for the right groups.
+                result = regex.match(value)
+            if result is not None:
+                return pat, what, result
+        return None, None, None
+
+
 class Reloader:
     """Checks to see if any loaded modules have changed on disk and,
     if so, reloads them.
@@ -773,6 +1171,9 @@ class Reloader:
     else:
         SUFFIX = ".pyc"
 
+    """Number of times a module has been reloaded, by any Reloader."""
+    generation = 0
+
     def __init__(self):
         self.mtimes = {}
 
@@ -802,6 +1203,7 @@ class Reloader:
             try:
                 reload(mod)
                 self.mtimes[mod] = mtime
+                Reloader.generation += 1
             except ImportError:
                 pass
 
@@ -0,0 +1,644 @@
+"""
+Async database API, for handlers served asynchronously
+(part of web.py)
+"""
+
+import asyncio
+import contextvars
+import itertools
+import os
+import re
+import time
+
+from .db import (
+    DB,
+    ResultSet,
+    SQLQuery,
+    UnknownDB,
+    _BasePool,
+    _FetchedCursor,
+    dburl2dict,
+    debug,
+    import_driver,
+)
+from .utils import group, storage
+
+__all__ = [
+    "async_database",
+    "AsyncDB",
+    "AsyncConnectionPool",
+]
+
+# Supported async db drivers, see AsyncDB.
+async_pg_drivers = ("asyncpg",)
+async_mysql_drivers = ("aiomysql",)
+async_sqlite_drivers = ("aiosqlite",)
+
+
+class AsyncConnectionPool(_BasePool):
+    """Pool of connections of an `AsyncDB`.
+
+    It works like `ConnectionPool`, with the same options, except that
+    `acquire` and `release` are coroutines and waiting for a connection
+    doesn't block the event loop. A pool is meant to be used in a single
+    event loop. `minsize` connections are kept open once they are opened,
+    but they are not opened in advance.
+    """
+
+    def __init__(
+        self,
+        db,
+        minsize=0,
+        maxsize=None,
+        timeout=None,
+        max_idle=None,
+        max_age=None,
+        ping=False,
+    ):
+        _BasePool.__init__(self, minsize, maxsize, timeout, max_idle, max_age, ping)
+        self.db = db
+
+    def _condition(self):
+        # created in the event loop, on first use
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, timeout=-1):
+        """Takes a connection from the pool, opening a new one if needed.
+        The `timeout` defaults to the one of the pool.
+        """
+        timeout, deadline = self._deadline(timeout)
+        while True:
+            conn = await self._take(deadline, timeout)
+            if conn is None:
+                return await self._open()
+            elif not self.ping or await self.db._check(conn):
+                return conn
+            await self._discard(conn)
+
+    async def _take(self, deadline, timeout):
+        """Returns an idle connection or None if a new one can be opened."""
+        cond = self._condition()
+        expired = []
+        try:
+            async with cond:
+                waited = False
+                while not self._available(expired):
+                    remaining = self._remaining(deadline, timeout, waited)
+                    try:
+                        await asyncio.wait_for(cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    waited = True
+                return self._checkout()
+        finally:
+            for conn in expired:
+                await self._discard(conn, counted=False)
+
+    async def _open(self):
+        try:
+            conn = await self.db._connect(self.db.keywords)
+        except BaseException:
+            async with self._condition():
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        self._opened(conn)
+        return conn
+
+    async def _discard(self, conn, counted=True):
+        """Closes `conn`, which is taken out of the pool if `counted`."""
+        async with self._condition():
+            self._closed(conn, counted)
+        try:
+            await self.db._close(conn)
+        except Exception:
+            pass
+
+    async def release(self, conn, discard=False):
+        """Puts `conn` back in the pool, or closes it if `discard` is true."""
+        async with self._condition():
+            if self._put_back(conn, discard):
+                return
+        await self._discard(conn)
+
+    async def close(self):
+        """Closes all the idle connections."""
+        for conn in self._take_idle():
+            await self._discard(conn)
+
+
+class AsyncTransaction:
+    """Transaction of an `AsyncDB`.
+
+    It is started by `async with db.transaction():`, which commits it at the
+    end of the block or rolls it back on an exception, or by
+    `t = await db.transaction()`. Like with `Transaction`, nested
+    transactions are savepoints.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.ctx = None
+        self.transaction_count = None
+
+    async def start(self):
+        ctx = self.db.ctx
+        if ctx.transactions:
+            self.ctx = ctx
+            self.transaction_count = len(ctx.transactions)
+            await self._savepoint("SAVEPOINT webpy_sp_%s")
+        else:
+            conn = await self.db._acquire()
+            try:
+                await self.db._begin(conn)
+            except BaseException:
+                await self.db._release(conn, discard=True)
+                raise
+            # the transaction is kept in the context of the task, where
+            # queries are made on its connection.
+            self.ctx = storage(dbq_count=ctx.dbq_count, db=conn, transactions=[])
+            self.db._task_ctx.set(self.ctx)
+            self.transaction_count = 0
+
+        self.ctx.transactions.append(self)
+        return self
+
+    def __await__(self):
+        return self.start().__await__()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exctype, excvalue, traceback):
+        if exctype is not None:
+            await self.rollback()
+        else:
+            await self.commit()
+
+    async def _savepoint(self, q):
+        await self.db._db_execute(self.ctx.db, SQLQuery(q % self.transaction_count))
+
+    async def _end(self, savepoint, end):
+        if len(self.ctx.transactions) <= self.transaction_count:
+            return
+        del self.ctx.transactions[self.transaction_count :]
+        if self.transaction_count:
+            await self._savepoint(savepoint)
+            return
+
+        conn, self.ctx.db = self.ctx.db, None
+        done = False
+        try:
+            await end(conn)
+            done = True
+        finally:
+            await self.db._release(conn, discard=not done)
+
+    async def commit(self):
+        await self._end("RELEASE SAVEPOINT webpy_sp_%s", self.db._commit)
+
+    async def rollback(self):
+        await self._end("ROLLBACK TO SAVEPOINT webpy_sp_%s", self.db._rollback)
+
+
+class AsyncDB(DB):
+    """Database with awaitable methods, for handlers served asynchronously.
+
+    The queries are made like the ones of `DB`, with the same arguments, but
+    they run on an async driver and `select`, `where`, `query`, `insert`,
+    `multiple_insert`, `update` and `delete` are coroutines. The rows are
+    fetched at once, so there is no `stream` option. Use `async_database`
+    to create one.
+
+    Each query takes a connection from an `AsyncConnectionPool`, configured
+    with the `pool_*` keywords like for `DB`, so concurrent tasks run their
+    queries at the same time on different connections. The queries of a
+    transaction run on its connection, one at a time.
+
+        >>> db = AsyncDB(None, {})
+        >>> db.select('foo', where="x = $x", vars=dict(x=1), _test=True)
+        <sql: 'SELECT * FROM foo WHERE x = 1'>
+    """
+
+    def __init__(self, db_module, keywords):
+        keywords.setdefault("pooling", True)
+        DB.__init__(self, db_module, keywords)
+        self._task_ctx = contextvars.ContextVar("webpy_db_%d" % id(self))
+
+    def _getctx(self):
+        ctx = self._task_ctx.get(None)
+        if ctx is None:
+            ctx = storage(dbq_count=0, db=None, transactions=[])
+            self._task_ctx.set(ctx)
+        return ctx
+
+    ctx = property(_getctx)
+
+    @property
+    def pool(self):
+        """The `AsyncConnectionPool` of this database, None if pooling is
+        disabled.
+        """
+        if self._pool is None and self.has_pooling:
+            self._pool = AsyncConnectionPool(self, **self._pool_options)
+        return self._pool
+
+    async def _acquire(self):
+        if self.has_pooling:
+            return await self.pool.acquire()
+        return await self._connect(self.keywords)
+
+    async def _release(self, conn, discard=False):
+        if self.has_pooling:
+            await self.pool.release(conn, discard)
+        else:
+            await self._close(conn)
+
+    # Driver specific methods. The defaults work for drivers with cursors
+    # like the ones of DB-API, with coroutine methods.
+
+    async def _connect(self, keywords):
+        return await self.db_module.connect(**keywords)
+
+    async def _close(self, conn):
+        await conn.close()
+
+    async def _execute(self, conn, query, params):
+        """Executes `query` and returns a `_FetchedCursor` with its rows."""
+        cur = await conn.cursor()
+        try:
+            await cur.execute(query, params)
+            rows = await cur.fetchall() if cur.description else []
+            return _FetchedCursor(cur.description, rows, cur.rowcount)
+        finally:
+            await cur.close()
+
+    async def _begin(self, conn):
+        await self._execute(conn, "BEGIN", [])
+
+    async def _commit(self, conn):
+        await conn.commit()
+
+    async def _rollback(self, conn):
+        await conn.rollback()
+
+    async def _check(self, conn):
+        try:
+            await self._execute(conn, "SELECT 1", [])
+            await self._rollback(conn)
+            return True
+        except Exception:
+            return False
+
+    async def _insert_id_query(self, tablename, seqname):
+        """Returns the query giving the id of the last inserted row, or None."""
+        return None
+
+    async def _db_execute(self, conn, sql_query):
+        """executes an sql query"""
+        self.ctx.dbq_count += 1
+
+        try:
+            a = time.perf_counter()
+            query, params = self._process_query(sql_query)
+            cur = await self._execute(conn, query, params)
+            b = time.perf_counter()
+        except:
+            if self.printing:
+                print("ERR:", str(sql_query), file=debug)
+            raise
+
+        self._log_query(cur, sql_query, query, len(params), b - a)
+        return cur
+
+    async def _run(self, *queries):
+        """Runs `queries` in the current transaction, or else on a connection
+        from the pool and commits them. Returns the cursor of the last one.
+        """
+        ctx = self.ctx
+        if ctx.transactions:
+            for q in queries:
+                cur = await self._db_execute(ctx.db, q)
+            return cur
+
+        conn = await self._acquire()
+        done = False
+        try:
+            for q in queries:
+                cur = await self._db_execute(conn, q)
+            await self._commit(conn)
+            done = True
+        finally:
+            # the state of the connection isn't known after an error or
+            # a cancellation.
+            await self._release(conn, discard=not done)
+        return cur
+
+    async def query(
+        self, sql_query, vars=None, processed=False, _test=False, row_type=None
+    ):
+        """
+        Execute SQL query `sql_query` using dictionary `vars` to interpolate it.
+        See `DB.query`.
+        """
+        sql_query = DB.query(self, sql_query, vars, processed, _test=True)
+        if _test:
+            return sql_query
+
+        cur = await self._run(sql_query)
+        if cur.description:
+            return ResultSet(cur, row_type=row_type)
+        return cur.rowcount
+
+    def select(
+        self,
+        tables,
+        vars=None,
+        what="*",
+        where=None,
+        order=None,
+        group=None,
+        limit=None,
+        offset=None,
+        _test=False,
+        row_type=None,
+    ):
+        """
+        Selects `what` from `tables` with clauses `where`, `order`,
+        `group`, `limit`, and `offset`. See `DB.select`.
+        """
+        qout = DB.select(
+            self, tables, vars, what, where, order, group, limit, offset, _test=True
+        )
+        if _test:
+            return qout
+        return self.query(qout, processed=True, row_type=row_type)
+
+    def where(
+        self,
+        table,
+        what="*",
+        order=None,
+        group=None,
+        limit=None,
+        offset=None,
+        _test=False,
+        **kwargs,
+    ):
+        """
+        Selects from `table` where keys are equal to values in `kwargs`.
+        See `DB.where`.
+        """
+        return self.select(
+            table,
+            what=what,
+            order=order,
+            group=group,
+            limit=limit,
+            offset=offset,
+            _test=_test,
+            where=kwargs or None,
+        )
+
+    async def insert(self, tablename, seqname=None, _test=False, **values):
+        """
+        Inserts `values` into `tablename`. Returns current sequence ID.
+        See `DB.insert`.
+        """
+        sql_query = DB.insert(self, tablename, seqname, _test=True, **values)
+        if _test:
+            return sql_query
+
+        id_query = None
+        if seqname is not False:
+            id_query = await self._insert_id_query(tablename, seqname)
+        if id_query is None:
+            await self._run(sql_query)
+            return None
+
+        cur = await self._run(sql_query, id_query)
+        return cur.fetchone()[0]
+
+    async def multiple_insert(
+        self, tablename, values, seqname=None, _test=False, chunk_size=None
+    ):
+        """
+        Inserts multiple rows into `tablename`, in a single transaction.
+        See `DB.multiple_insert`.
+        """
+        rows = iter(values)
+        first = next(rows, None)
+        if first is None:
+            return []
+        rows = itertools.chain([first], rows)
+
+        if _test:
+            return self._multiple_insert_query(tablename, first.keys(), list(rows))
+
+        if chunk_size is None:
+            chunk_size = max(self.max_params // max(len(first), 1), 1)
+
+        id_query = None
+        if seqname is not False:
+            id_query = await self._insert_id_query(tablename, seqname)
+
+        out = []
+        async with self.transaction():
+            for chunk in group(rows, chunk_size):
+                sql_query = self._multiple_insert_query(tablename, first.keys(), chunk)
+                if id_query is None:
+                    await self._run(sql_query)
+                    continue
+
+                cur = await self._run(sql_query, id_query)
+                last = cur.fetchone()[0]
+                # MySQL gives the first id of multiple inserted rows.
+                # PostgreSQL and SQLite give the last id.
+                if self.dbname == "mysql":
+                    out.extend(range(last, last + len(chunk)))
+                else:
+                    out.extend(range(last - len(chunk) + 1, last + 1))
+
+        if id_query is None:
+            return None
+        return out
+
+    async def update(self, tables, where, vars=None, _test=False, **values):
+        """
+        Update `tables` with clause `where` (interpolated using `vars`)
+        and setting `values`. See `DB.update`.
+        """
+        q = DB.update(self, tables, where, vars, _test=True, **values)
+        if _test:
+            return q
+        cur = await self._run(q)
+        return cur.rowcount
+
+    async def delete(self, table, where, using=None, vars=None, _test=False):
+        """
+        Deletes from `table` with clauses `where` and `using`.
+        See `DB.delete`.
+        """
+        q = DB.delete(self, table, where, using, vars, _test=True)
+        if _test:
+            return q
+        cur = await self._run(q)
+        return cur.rowcount
+
+    def transaction(self):
+        """Start a transaction, see `AsyncTransaction`."""
+        return AsyncTransaction(self)
+
+
+class AsyncPostgresDB(AsyncDB):
+    """Postgres database, using asyncpg."""
+
+    def __init__(self, **keywords):
+        db_module = import_driver(
+            async_pg_drivers, preferred=keywords.pop("driver", None)
+        )
+        if "pw" in keywords:
+            keywords["password"] = keywords.pop("pw")
+        if "db" in keywords:
+            keywords["database"] = keywords.pop("db")
+
+        self.dbname = "postgres"
+        # asyncpg takes $1, $2, ... params, see _process_query.
+        self.paramstyle = "format"
+        AsyncDB.__init__(
+            self, db_module, {k: v for k, v in keywords.items() if v is not None}
+        )
+        self.supports_multiple_insert = True
+        self.max_params = 32767
+        self._sequences = None
+
+    def _process_query(self, sql_query):
+        query, params = AsyncDB._process_query(self, sql_query)
+        n = itertools.count(1)
+        query = re.sub(
+            "%[%s]",
+            lambda m: "%" if m.group() == "%%" else "$%d" % next(n),
+            query,
+        )
+        return query, params
+
+    async def _execute(self, conn, query, params):
+        stmt = await conn.prepare(query)
+        rows = await stmt.fetch(*params)
+        description = [(a.name,) for a in stmt.get_attributes()] or None
+        # the status is like "UPDATE 3"
+        status = stmt.get_statusmsg().split()
+        rowcount = int(status[-1]) if status and status[-1].isdigit() else -1
+        return _FetchedCursor(description, rows, rowcount)
+
+    async def _begin(self, conn):
+        await conn.execute("BEGIN")
+
+    async def _commit(self, conn):
+        if conn.is_in_transaction():
+            await conn.execute("COMMIT")
+
+    async def _rollback(self, conn):
+        if conn.is_in_transaction():
+            await conn.execute("ROLLBACK")
+
+    async def _insert_id_query(self, tablename, seqname):
+        if seqname is None:
+            # guess the seqname and make sure it exists, like PostgresDB.
+            seqname = tablename + "_id_seq"
+            if self._sequences is None:
+                q = "SELECT c.relname FROM pg_class c WHERE c.relkind = 'S'"
+                self._sequences = {c.relname for c in await self.query(q)}
+            if seqname not in self._sequences:
+                return None
+
+        if not re.match(r"^[a-zA-Z_][a-zA-Z0-9_$]*$", seqname):
+            raise ValueError(f"Invalid sequence name: {seqname}")
+        return SQLQuery(f"SELECT currval('{seqname}')")
+
+
+class AsyncMySQLDB(AsyncDB):
+    """MySQL database, using aiomysql."""
+
+    def __init__(self, **keywords):
+        db_module = import_driver(
+            async_mysql_drivers, preferred=keywords.pop("driver", None)
+        )
+        if "pw" in keywords:
+            keywords["password"] = keywords.pop("pw")
+        if "charset" not in keywords:
+            keywords["charset"] = "utf8"
+
+        self.dbname = "mysql"
+        self.paramstyle = "pyformat"
+        AsyncDB.__init__(
+            self, db_module, {k: v for k, v in keywords.items() if v is not None}
+        )
+        self.supports_multiple_insert = True
+        self.max_params = 65535
+
+    async def _close(self, conn):
+        await conn.ensure_closed()
+
+    async def _begin(self, conn):
+        await conn.begin()
+
+    async def _insert_id_query(self, tablename, seqname):
+        return SQLQuery("SELECT last_insert_id();")
+
+    def _get_insert_default_values_query(self, table):
+        return "INSERT INTO %s () VALUES()" % table
+
+
+class AsyncSqliteDB(AsyncDB):
+    """SQLite database, using aiosqlite."""
+
+    def __init__(self, **keywords):
+        db_module = import_driver(
+            async_sqlite_drivers, preferred=keywords.pop("driver", None)
+        )
+        import sqlite3
+
+        # aiosqlite passes the keywords on to sqlite3.connect
+        keywords.setdefault("detect_types", sqlite3.PARSE_DECLTYPES)
+        keywords["database"] = keywords.pop("db")
+
+        self.dbname = "sqlite"
+        self.paramstyle = "qmark"
+        AsyncDB.__init__(self, db_module, keywords)
+        self.supports_multiple_insert = True
+
+    async def _insert_id_query(self, tablename, seqname):
+        return SQLQuery("SELECT last_insert_rowid();")
+
+
+_async_databases = {
+    "postgres": AsyncPostgresDB,
+    "mysql": AsyncMySQLDB,
+    "sqlite": AsyncSqliteDB,
+}
+
+
+def async_database(dburl=None, **params):
+    """Creates an `AsyncDB`, the async counterpart of `database`, for
+    PostgreSQL with asyncpg, MySQL with aiomysql or SQLite with aiosqlite.
+
+        db = web.async_database(dbn='postgres', db='dbname', user='username')
+
+        async def GET(self):
+            users = await db.select('users', limit=10)
+    """
+    if not dburl and not params:
+        dburl = os.environ["DATABASE_URL"]
+
+    if dburl:
+        params = dburl2dict(dburl)
+
+    dbn = params.pop("dbn")
+    if dbn in _async_databases:
+        return _async_databases[dbn](**params)
+    else:
+        raise UnknownDB(dbn)
@@ -3,29 +3,40 @@ Database API
 (part of web.py)
 """
 
+import array
 import ast
+import collections
 import datetime
+import decimal
+import functools
+import importlib
+import itertools
+import math
 import os
 import re
+import threading
 import time
 from urllib.parse import unquote, urlparse
 
 from .py3helpers import iteritems
-from .utils import iters, safestr, safeunicode, storage, threadeddict
+from .utils import ThreadedDict, group, iters, safestr, safeunicode, storage
 
 try:
     # db module can work independent of web.py
     from .webapi import config, debug
+    from .webapi import ctx as webctx
 except ImportError:
     import sys
 
     debug = sys.stderr
     config = storage()
+    webctx = None
 
 __all__ = [
     "UnknownParamstyle",
     "UnknownDB",
     "TransactionError",
+    "PoolTimeout",
     "sqllist",
     "sqlors",
     "reparam",
@@ -37,6 +48,8 @@ __all__ = [
     "sqlliteral",
     "database",
     "DB",
+    "RoutingDB",
+    "ConnectionPool",
 ]
 
 TOKEN = "[ \\f\\t]*(\\\\\\r?\\n[ \\f\\t]*)*(#[^\\r\\n]*)?(((\\d+[jJ]|((\\d+\\.\\d*|\\.\\d+)([eE][-+]?\\d+)?|\\d+[eE][-+]?\\d+)[jJ])|((\\d+\\.\\d*|\\.\\d+)([eE][-+]?\\d+)?|\\d+[eE][-+]?\\d+)|(0[xX][\\da-fA-F]+[lL]?|0[bB][01]+[lL]?|(0[oO][0-7]+)|(0[0-7]*)[lL]?|[1-9]\\d*[lL]?))|((\\*\\*=?|>>=?|<<=?|<>|!=|//=?|[+\\-*/%&|^=<>]=?|~)|[][(){}]|(\\r?\\n|[:;.,`@]))|([uUbB]?[rR]?'[^\\n'\\\\]*(?:\\\\.[^\\n'\\\\]*)*'|[uUbB]?[rR]?\"[^\\n\"\\\\]*(?:\\\\.[^\\n\"\\\\]*)*\")|[a-zA-Z_]\\w*)"  # noqa: E501
@@ -69,6 +82,12 @@ class TransactionError(Exception):
     pass
 
 
+class PoolTimeout(Exception):
+    """raised when no connection could be taken from the pool in time"""
+
+    pass
+
+
 class UnknownParamstyle(Exception):
     """
     raised for unsupported db paramstyles
@@ -463,31 +482,331 @@ def sqlquote(a):
         return sqlparam(a).sqlquery()
 
 
+class _Statement:
+    """Shape of a generated query, with the query strings built from it.
+
+    Binding new values to it gives a query that is equal to the one the
+    statement was made from, with these values for its params.
+
+        >>> q = SQLQuery(["SELECT * FROM foo WHERE x = ", SQLParam(1)])
+        >>> q = _Statement(q).bind([2])
+        >>> q, q.query("qmark"), q.values()
+        (<sql: 'SELECT * FROM foo WHERE x = 2'>, 'SELECT * FROM foo WHERE x = ?', [2])
+    """
+
+    def __init__(self, query):
+        self.items = list(query.items)
+        self.positions = []
+        for i, item in enumerate(self.items):
+            if isinstance(item, SQLParam):
+                self.items[i] = SQLParam(None)
+                self.positions.append(i)
+        self.queries = {}
+
+    def bind(self, values):
+        items = list(self.items)
+        for i, value in zip(self.positions, values):
+            items[i] = SQLParam(value)
+        return _BoundQuery(items, self, values)
+
+    def query(self, paramstyle):
+        try:
+            return self.queries[paramstyle]
+        except KeyError:
+            q = self.queries[paramstyle] = SQLQuery(self.items).query(paramstyle)
+            return q
+
+
+class _BoundQuery(SQLQuery):
+    """SQLQuery made from a `_Statement`, reusing its query strings."""
+
+    __slots__ = ["statement", "params"]
+
+    def __init__(self, items, statement, params):
+        self.items = items
+        self.statement = statement
+        self.params = params
+
+    def query(self, paramstyle=None):
+        if len(self.items) != len(self.statement.items):
+            # modified after binding
+            return SQLQuery.query(self, paramstyle)
+        return self.statement.query(paramstyle)
+
+    def values(self):
+        if len(self.items) != len(self.statement.items):
+            return SQLQuery.values(self)
+        return list(self.params)
+
+
+def _is_scalar(value):
+    """Tells if `value` becomes a single param when quoted."""
+    return not isinstance(value, (list, tuple, set, SQLLiteral))
+
+
+def _clause_shape(sql, val, vars):
+    """Returns the shape of clause `val` of the generated query and the
+    values of its params, or None if the shape depends on the values.
+    """
+    if isinstance(val, int):
+        if sql == "WHERE":
+            return ("id",), [val]
+        return ("int", val), []
+    elif isinstance(val, str):
+        values = []
+        try:
+            for node in _parse(val):
+                if node.type == "param":
+                    values.append(vars[node.first])
+                elif node.type != "text":
+                    values.append(SafeEval().eval_expr(node, vars))
+        except Exception:
+            return None
+        if all(_is_scalar(v) for v in values):
+            return ("str", val), values
+    elif isinstance(val, dict) and sql in ["WHERE", "SET"]:
+        keys = tuple(sorted(val))
+        values = [val[k] for k in keys]
+        if all(_is_scalar(v) for v in values):
+            return ("dict", keys), values
+    elif isinstance(val, SQLQuery):
+        items = tuple(None if isinstance(x, SQLParam) else x for x in val.items)
+        return ("sql", items), val.values()
+    return None
+
+
+class _TupleRow(tuple):
+    """Base of the classes of rows made with `row_type="namedtuple"`.
+
+    It comes after the namedtuple class in the bases, so that columns named
+    like its methods, such as `keys`, can be read as attributes. Like with
+    `storage`, `in` tells if there is a column of that name.
+    """
+
+    __slots__ = ()
+    _keys = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._keys[key]
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+
+    def keys(self):
+        return list(self._keys)
+
+
+class _SlotsRow:
+    """Base of the classes of rows made with `row_type="slots"`."""
+
+    __slots__ = ()
+    _keys = {}
+
+    def __getitem__(self, key):
+        return getattr(self, self._keys[key])
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+
+    def keys(self):
+        return list(self._keys)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            self[k] == other[k] for k in self._keys
+        )
+
+    def __repr__(self):
+        return "<Row %r>" % {k: self[k] for k in self._keys}
+
+
+@functools.lru_cache(maxsize=256)
+def _row_class(row_type, names):
+    # namedtuple takes care of turning the column names into valid and
+    # unique attribute names.
+    base = collections.namedtuple("Row", names, rename=True)
+    fields = base._fields
+    keys = {}
+    for i, name in enumerate(names):
+        keys.setdefault(name, i if row_type == "namedtuple" else fields[i])
+
+    if row_type == "namedtuple":
+        return type("Row", (base, _TupleRow), {"__slots__": (), "_keys": keys})
+    else:
+        return type("Row", (_SlotsRow,), {"__slots__": fields, "_keys": keys})
+
+
+def _row_factory(names, row_type):
+    """Returns the function making rows of `row_type` from the rows of the
+    cursor, for columns `names`.
+
+    The rows are `storage` objects by default. With "tuple", they are left
+    as tuples. With "namedtuple" and "slots", they are instances of a
+    class shared by all the rows, which store their values in a tuple or in
+    slots and support both attribute and key access.
+
+        >>> rows = [(1, "foo")]
+        >>> [_row_factory(["id", "name"], t)(rows[0]) for t in ["storage", "tuple"]]
+        [<Storage {'id': 1, 'name': 'foo'}>, (1, 'foo')]
+        >>> row = _row_factory(["id", "name"], "namedtuple")(rows[0])
+        >>> row, row.name, row["id"], row[1]
+        (Row(id=1, name='foo'), 'foo', 1, 'foo')
+        >>> row = _row_factory(["id", "count(*)"], "slots")(rows[0])
+        >>> row, row.id, row["count(*)"]
+        (<Row {'id': 1, 'count(*)': 'foo'}>, 1, 'foo')
+    """
+    if row_type in [None, "storage"]:
+        return lambda row: storage(zip(names, row))
+    elif row_type == "tuple":
+        return tuple
+    elif row_type not in ["namedtuple", "slots"]:
+        raise ValueError("unknown row_type: %r" % row_type)
+
+    cls = _row_class(row_type, tuple(names))
+    if row_type == "namedtuple":
+        return cls._make
+
+    setters = [getattr(cls, f).__set__ for f in cls.__slots__]
+    new = object.__new__
+
+    def make(row):
+        obj = new(cls)
+        for set_value, value in zip(setters, row):
+            set_value(obj, value)
+        return obj
+
+    return make
+
+
+_number_types = {int, float, decimal.Decimal, type(None)}
+
+
+def _extend_column(column, values):
+    """Adds `values` to `column`, which is an array as long as all the
+    values are numbers, or None, and a list otherwise.
+
+    The array holds 64-bit integers as long as all the values are integers,
+    and floats otherwise: decimals are then converted to floats and None to
+    NaN. When the column becomes a list, NaN is None again.
+    """
+    types = set(map(type, values))
+    if column is None:
+        if types == {int}:
+            column = array.array("q")
+        elif types <= _number_types:
+            column = array.array("d")
+        else:
+            return list(values)
+
+    if isinstance(column, array.array):
+        size = len(column)
+        try:
+            if types == {int} and column.typecode == "q":
+                column.extend(values)
+                return column
+            elif types <= _number_types:
+                if column.typecode == "q":
+                    column = array.array("d", column)
+                column.extend(math.nan if v is None else float(v) for v in values)
+                return column
+        except OverflowError:
+            pass
+        column = [None if math.isnan(x) else x for x in column[:size].tolist()]
+
+    column.extend(values)
+    return column
+
+
 class BaseResultSet:
-    """Base implementation of Result Set, the result of a db query."""
+    """Base implementation of Result Set, the result of a db query.
 
-    def __init__(self, cursor):
+    Rows are fetched from the cursor `batch_size` at a time. See
+    `_row_factory` for the `row_type` of the rows.
+    """
+
+    batch_size = 100
+
+    def __init__(self, cursor, batch_size=None, row_type=None):
         self.cursor = cursor
-        self.names = [x[0] for x in cursor.description]
+        self.batch_size = batch_size or self.batch_size
+        self._rows = collections.deque()
         self._index = 0
+        if cursor.description is None:
+            # server-side cursors know their columns only after a fetch
+            self._fetch()
+        self.names = [x[0] for x in cursor.description]
+        if row_type is not None:
+            self._prepare_row = _row_factory(self.names, row_type)
+
+    def _fetch(self):
+        """Fetches the next batch of rows. Returns False if there are no
+        more rows.
+        """
+        self._rows.extend(self.cursor.fetchmany(self.batch_size))
+        return bool(self._rows)
 
     def list(self):
-        rows = [self._prepare_row(d) for d in self.cursor.fetchall()]
+        rows = list(self._rows)
+        self._rows.clear()
+        rows.extend(self.cursor.fetchall())
+        rows = [self._prepare_row(d) for d in rows]
         self._index += len(rows)
         return rows
 
     def _prepare_row(self, row):
-        return storage(dict(zip(self.names, row)))
+        return storage(zip(self.names, row))
+
+    def to_columns(self, use_numpy=None):
+        """Reads the remaining rows and returns them by column, as a
+        storage mapping the column names to sequences of values.
+
+        Columns of numbers are filled into `array.array`s, batch by batch,
+        and turned into NumPy arrays if NumPy is installed, unless
+        `use_numpy` is False. Pass `use_numpy=True` to require NumPy
+        arrays. Columns of integers are arrays of 64-bit integers. Columns
+        with floats, decimals or NULLs are arrays of floats, where NULL is
+        NaN. Other columns are lists.
+        """
+        columns = [None] * len(self.names)
+        while self._rows or self._fetch():
+            batch = list(self._rows)
+            self._rows.clear()
+            self._index += len(batch)
+            for i, values in enumerate(zip(*batch)):
+                columns[i] = _extend_column(columns[i], values)
+
+        if use_numpy is not False:
+            try:
+                import numpy
+            except ImportError:
+                if use_numpy:
+                    raise
+                numpy = None
+
+        for i, column in enumerate(columns):
+            if column is None:
+                columns[i] = []
+            elif isinstance(column, array.array) and use_numpy is not False and numpy:
+                dtype = "int64" if column.typecode == "q" else "float64"
+                columns[i] = numpy.frombuffer(column, dtype=dtype)
+        return storage(zip(self.names, columns))
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        row = self.cursor.fetchone()
-        if row is None:
+        if not self._rows and not self._fetch():
             raise StopIteration()
         self._index += 1
-        return self._prepare_row(row)
+        return self._prepare_row(self._rows.popleft())
 
     next = __next__  # for python 2.7 support
 
@@ -531,28 +850,60 @@ class SqliteResultSet(BaseResultSet):
     Same functionally as ResultSet except len is not supported.
     """
 
-    def __init__(self, cursor):
-        BaseResultSet.__init__(self, cursor)
-        self._head = None
-
-    def __next__(self):
-        if self._head is not None:
-            self._index += 1
-            return self._head
-        else:
-            return super().__next__()
-
     def __bool__(self):
         # The ResultSet class class doesn't need to support __bool__ explicitly
         # because it has __len__. Since SqliteResultSet doesn't support len,
         # we need to peep into the result to find if the result is empty of not.
-        if self._head is None:
-            try:
-                self._head = next(self)
-                self._index -= 1  # reset the index
-            except StopIteration:
-                return False
-        return True
+        return bool(self._rows) or self._fetch()
+
+
+class StreamResultSet(BaseResultSet):
+    """Result Set of a query made with `stream=True`.
+
+    The rows are read from a server-side cursor, where the database has
+    one, as the result is iterated. The result set is closed once all the
+    rows have been read, and `on_close` is then called with it. Result sets
+    left open are closed at the end of the request.
+
+    Like SqliteResultSet, len is not supported.
+    """
+
+    def __init__(self, cursor, batch_size=None, on_close=None, row_type=None):
+        self.on_close = on_close
+        self.closed = False
+        self.names = None
+        BaseResultSet.__init__(self, cursor, batch_size, row_type)
+
+    def _fetch(self):
+        if self.closed:
+            return False
+        elif BaseResultSet._fetch(self):
+            return True
+        elif self.names is not None:
+            self.close()
+        return False
+
+    def list(self):
+        rows = BaseResultSet.list(self)
+        self.close()
+        return rows
+
+    def __bool__(self):
+        return bool(self._rows) or self._fetch()
+
+    def close(self):
+        """Closes the cursor and calls `on_close`."""
+        if not self.closed:
+            self.closed = True
+            self.cursor.close()
+            if self.on_close:
+                self.on_close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.close()
 
 
 class Transaction:
@@ -628,6 +979,265 @@ class Transaction:
             self.ctx.transactions = self.ctx.transactions[: self.transaction_count]
 
 
+class _BasePool:
+    """Bookkeeping of the connections of a pool, shared by `ConnectionPool`
+    and `AsyncConnectionPool`, which add the locking and the opening and
+    closing of the connections. The methods are called with the condition
+    `_cond` held.
+    """
+
+    def __init__(
+        self,
+        minsize=0,
+        maxsize=None,
+        timeout=None,
+        max_idle=None,
+        max_age=None,
+        ping=False,
+    ):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.ping = ping
+
+        self._cond = None
+        self._idle = collections.deque()  # (connection, release time), LIFO
+        self._created = {}  # id(connection) -> creation time
+        self._size = 0
+        self._stats = storage(checkouts=0, waits=0, timeouts=0, connects=0)
+
+    def _deadline(self, timeout):
+        """Returns the `timeout` of `acquire`, which defaults to the one of
+        the pool, and its deadline, None if it can wait forever.
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        return timeout, None if timeout is None else time.monotonic() + timeout
+
+    def _available(self, expired):
+        """Returns whether a connection can be taken: an idle one, or a new
+        one, which is then counted in the size of the pool. The idle
+        connections to be closed are added to `expired`.
+        """
+        expired += self._expired()
+        if self._idle:
+            return True
+        if self.maxsize is None or self._size < self.maxsize:
+            self._size += 1
+            return True
+        return False
+
+    def _remaining(self, deadline, timeout, waited):
+        """Returns how long to wait for a connection to be released, or
+        raises `PoolTimeout` when the `deadline` is passed.
+        """
+        if not waited:
+            self._stats.waits += 1
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            self._stats.timeouts += 1
+            raise PoolTimeout("no connection available after %s seconds" % timeout)
+        return remaining
+
+    def _checkout(self):
+        """Returns an idle connection, or None if a new one is to be opened."""
+        self._stats.checkouts += 1
+        return self._idle.pop()[0] if self._idle else None
+
+    def _expired(self):
+        """Removes the idle connections to be closed and returns them."""
+        now = time.monotonic()
+        expired = []
+        while self._idle and self._size > self.minsize:
+            conn, released = self._idle[0]
+            if self.max_idle is None or released + self.max_idle > now:
+                break
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+
+        if self.max_age is not None:
+            for conn, released in list(self._idle):
+                if self._created[id(conn)] + self.max_age <= now:
+                    self._idle.remove((conn, released))
+                    expired.append(conn)
+                    self._size -= 1
+
+        if expired:
+            self._cond.notify(len(expired))
+        return expired
+
+    def _opened(self, conn):
+        self._created[id(conn)] = time.monotonic()
+        self._stats.connects += 1
+
+    def _closed(self, conn, counted):
+        """Forgets `conn`, which is taken out of the pool if `counted`."""
+        self._created.pop(id(conn), None)
+        if counted:
+            self._size -= 1
+            self._cond.notify()
+
+    def _put_back(self, conn, discard):
+        """Puts `conn` back with the idle connections, unless it is to be
+        discarded or is too old. Returns whether it was.
+        """
+        now = time.monotonic()
+        created = self._created.get(id(conn), now)
+        if not discard and (self.max_age is None or created + self.max_age > now):
+            self._idle.append((conn, now))
+            self._cond.notify()
+            return True
+        return False
+
+    def _take_idle(self):
+        idle = [conn for conn, released in self._idle]
+        self._idle.clear()
+        return idle
+
+    def stats(self):
+        """Returns the number of checkouts, waits and timeouts so far, and the
+        number of open and idle connections.
+        """
+        return storage(self._stats, size=self._size, idle=len(self._idle))
+
+
+class ConnectionPool(_BasePool):
+    """Pool of database connections.
+
+    New connections are opened by calling `connect`, as long as there are
+    less than `maxsize` of them; after that `acquire` waits up to `timeout`
+    seconds for a connection to be released and raises `PoolTimeout`.
+    `None` means no limit for both.
+
+    Idle connections beyond `minsize` are closed after `max_idle` seconds,
+    and connections are closed once they are `max_age` seconds old. With
+    `ping`, idle connections are checked with a `SELECT 1` before being
+    handed out and replaced if that fails.
+
+        >>> import sqlite3
+        >>> pool = ConnectionPool(lambda: sqlite3.connect(":memory:"), maxsize=1)
+        >>> conn = pool.acquire()
+        >>> pool.acquire(timeout=0)
+        Traceback (most recent call last):
+            ...
+        web.db.PoolTimeout: no connection available after 0 seconds
+        >>> pool.release(conn)
+        >>> pool.acquire() is conn
+        True
+        >>> pool.stats()
+        <Storage {'checkouts': 2, 'waits': 1, 'timeouts': 1, 'connects': 1, 'size': 1, 'idle': 0}>
+    """
+
+    def __init__(
+        self,
+        connect,
+        minsize=0,
+        maxsize=None,
+        timeout=None,
+        max_idle=None,
+        max_age=None,
+        ping=False,
+    ):
+        _BasePool.__init__(self, minsize, maxsize, timeout, max_idle, max_age, ping)
+        self.connect = connect
+        self._cond = threading.Condition()
+
+        for _ in range(self.minsize):
+            self._size += 1
+            self.release(self._open())
+
+    def acquire(self, timeout=-1):
+        """Takes a connection from the pool, opening a new one if needed.
+        The `timeout` defaults to the one of the pool.
+        """
+        timeout, deadline = self._deadline(timeout)
+        while True:
+            conn = self._take(deadline, timeout)
+            if conn is None:
+                return self._open()
+            elif not self.ping or self._check(conn):
+                return conn
+            self._discard(conn)
+
+    def _take(self, deadline, timeout):
+        """Returns an idle connection or None if a new one can be opened."""
+        expired = []
+        try:
+            with self._cond:
+                waited = False
+                while not self._available(expired):
+                    self._cond.wait(self._remaining(deadline, timeout, waited))
+                    waited = True
+                return self._checkout()
+        finally:
+            for conn in expired:
+                self._discard(conn, counted=False)
+
+    def _open(self):
+        try:
+            conn = self.connect()
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._opened(conn)
+        return conn
+
+    def _check(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchall()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn, counted=True):
+        """Closes `conn`, which is taken out of the pool if `counted`."""
+        with self._cond:
+            self._closed(conn, counted)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self, conn, discard=False):
+        """Puts `conn` back in the pool, or closes it if `discard` is true."""
+        with self._cond:
+            if self._put_back(conn, discard):
+                return
+        self._discard(conn)
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self._cond:
+            idle = self._take_idle()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return _BasePool.stats(self)
+
+
+class _DBContext(ThreadedDict):
+    """Connection state of a DB, per thread. The connection is released
+    when it is cleared, at the end of each request.
+    """
+
+    def clear(self):
+        if "db" in self:
+            self.release()
+        super().clear()
+
+
 class DB:
     """Database"""
 
@@ -640,21 +1250,34 @@ class DB:
         self.db_module = db_module
         self.keywords = keywords
 
-        self._ctx = threadeddict()
+        self._ctx = _DBContext()
         # flag to enable/disable printing queries
         self.printing = config.get("debug_sql", config.get("debug", False))
+        self.slow_query_threshold = config.get("slow_query_threshold")
+        self.n_plus_one_threshold = config.get("n_plus_one_threshold")
+        # functions called with the details of each query
+        self.query_hooks = []
         self.supports_multiple_insert = False
-
-        try:
-            import dbutils  # noqa: F401
-
-            # enable pooling if DBUtils module is available.
-            self.has_pooling = True
-        except ImportError:
-            self.has_pooling = False
-
-        # Pooling can be disabled by passing pooling=False in the keywords.
-        self.has_pooling = self.keywords.pop("pooling", True) and self.has_pooling
+        # maximum number of params in a query, for multiple_insert.
+        self.max_params = 999
+        self._statements = {}
+
+        # Pooling is enabled by passing pooling=True in the keywords.
+        self.has_pooling = self.keywords.pop("pooling", False)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_options = {
+            k[len("pool_") :]: self.keywords.pop(k)
+            for k in (
+                "pool_minsize",
+                "pool_maxsize",
+                "pool_timeout",
+                "pool_max_idle",
+                "pool_max_age",
+                "pool_ping",
+            )
+            if k in self.keywords
+        }
 
     def _getctx(self):
         if not self._ctx.get("db"):
@@ -666,6 +1289,7 @@ class DB:
     def _load_context(self, ctx):
         ctx.dbq_count = 0
         ctx.transactions = []  # stack of transactions
+        ctx.streams = []  # open StreamResultSets, using the connection
 
         if self.has_pooling:
             ctx.db = self._connect_with_pooling(self.keywords)
@@ -682,42 +1306,66 @@ class DB:
         def commit(unload=True):
             # do db commit and release the connection if pooling is enabled.
             ctx.db.commit()
-            if unload and self.has_pooling:
+            if unload and self.has_pooling and not ctx.streams:
                 self._unload_context(self._ctx)
 
         def rollback():
             # do db rollback and release the connection if pooling is enabled.
             ctx.db.rollback()
-            if self.has_pooling:
+            if self.has_pooling and not ctx.streams:
                 self._unload_context(self._ctx)
 
+        def release():
+            # the request is over: close the streams it left open, roll back
+            # what it left uncommitted, like an abandoned transaction, and put
+            # the connection back in the pool.
+            for stream in ctx.streams:
+                stream.on_close = None
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            ctx.streams = []
+
+            if self.has_pooling:
+                try:
+                    ctx.db.rollback()
+                except Exception:
+                    self._pool.release(ctx.db, discard=True)
+                else:
+                    self._pool.release(ctx.db)
+            del ctx.db
+
         ctx.commit = commit
         ctx.rollback = rollback
+        ctx.release = release
 
     def _unload_context(self, ctx):
+        if self._pool is not None:
+            self._pool.release(ctx.db)
         del ctx.db
 
     def _connect(self, keywords):
         return self.db_module.connect(**keywords)
 
     def _connect_with_pooling(self, keywords):
-        def get_pooled_db():
-            # In DBUtils 2.0.0, names were made pep8 compliant
-            # https://webwareforpython.github.io/DBUtils/changelog.html
-            from dbutils import pooled_db as PooledDB
-
-            # In DBUtils 0.9.3, `dbapi` argument is renamed as `creator`
-            # see Bug#122112
+        return self.pool.acquire()
 
-            if PooledDB.__version__.split(".") < "0.9.3".split("."):
-                return PooledDB.PooledDB(dbapi=self.db_module, **keywords)
-            else:
-                return PooledDB.PooledDB(creator=self.db_module, **keywords)
+    @property
+    def pool(self):
+        """The `ConnectionPool` of this database, None if pooling is disabled.
 
-        if getattr(self, "_pooleddb", None) is None:
-            self._pooleddb = get_pooled_db()
-
-        return self._pooleddb.connection()
+        It is created on first use, with the `pool_minsize`, `pool_maxsize`,
+        `pool_timeout`, `pool_max_idle`, `pool_max_age` and `pool_ping`
+        keywords given to the database.
+        """
+        if self._pool is None and self.has_pooling:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        lambda: self._connect(self.keywords), **self._pool_options
+                    )
+        return self._pool
 
     def _db_cursor(self):
         return self.ctx.db.cursor()
@@ -739,10 +1387,10 @@ class DB:
         self.ctx.dbq_count += 1
 
         try:
-            a = time.time()
+            a = time.perf_counter()
             query, params = self._process_query(sql_query)
             out = cur.execute(query, params)
-            b = time.time()
+            b = time.perf_counter()
         except:
             if self.printing:
                 print("ERR:", str(sql_query), file=debug)
@@ -752,12 +1400,56 @@ class DB:
                 self.ctx.rollback()
             raise
 
+        self._log_query(cur, sql_query, query, len(params), b - a)
+        return out
+
+    def _log_query(self, cur, sql_query, query, nparams, duration):
+        """Reports a query that took `duration` seconds.
+
+        The query is printed to `web.debug` when printing is enabled, or
+        when it takes `slow_query_threshold` seconds or more. During a
+        request, its count and duration are added to `web.ctx.db_queries` and
+        `web.ctx.db_time`, and a query made `n_plus_one_threshold` times in the
+        request is reported as a likely N+1 query. The queries are compared
+        without their values, so that is the case with the same values too.
+
+        Then each function of `query_hooks` is called with a storage of the
+        `query` string, without the values, the number of `params`, the
+        `duration` and the `rowcount` of the cursor.
+        """
         if self.printing:
             print(
-                f"{round(b - a, 2)} ({self.ctx.dbq_count}): {str(sql_query)}",
+                f"{round(duration, 2)} ({self.ctx.dbq_count}): {str(sql_query)}",
                 file=debug,
             )
-        return out
+        elif (
+            self.slow_query_threshold is not None
+            and duration >= self.slow_query_threshold
+        ):
+            print(f"SLOW QUERY {round(duration, 2)}: {str(sql_query)}", file=debug)
+
+        # outside of requests, nothing would ever reset the counts.
+        if webctx is not None and "environ" in webctx:
+            webctx.db_queries = webctx.get("db_queries", 0) + 1
+            webctx.db_time = webctx.get("db_time", 0) + duration
+
+            if self.n_plus_one_threshold:
+                counts = webctx.get("db_query_counts")
+                if counts is None:
+                    counts = webctx.db_query_counts = {}
+                n = counts[query] = counts.get(query, 0) + 1
+                if n == self.n_plus_one_threshold:
+                    print(f"N+1 QUERY, made {n} times: {query}", file=debug)
+
+        if self.query_hooks:
+            details = storage(
+                query=query,
+                params=nparams,
+                duration=duration,
+                rowcount=cur.rowcount,
+            )
+            for hook in self.query_hooks:
+                hook(details)
 
     def _process_query(self, sql_query):
         """Takes the SQLQuery object and returns query string and parameters."""
@@ -790,12 +1482,29 @@ class DB:
         else:
             return None
 
-    def query(self, sql_query, vars=None, processed=False, _test=False):
+    def query(
+        self,
+        sql_query,
+        vars=None,
+        processed=False,
+        _test=False,
+        stream=False,
+        row_type=None,
+    ):
         """
         Execute SQL query `sql_query` using dictionary `vars` to interpolate it.
         If `processed=True`, `vars` is a `reparam`-style list to use
         instead of interpolating.
 
+        With `stream=True`, the rows are read from a server-side cursor as
+        the result is iterated, instead of being loaded all at once; see
+        `StreamResultSet`. `stream` can also be the number of rows to fetch
+        at a time.
+
+        The rows are `storage` objects, unless `row_type` is "tuple",
+        "namedtuple" or "slots". The last two take much less memory than
+        storage objects and support both `row.name` and `row["name"]`.
+
             >>> db = DB(None, {})
             >>> db.query("SELECT * FROM foo", _test=True)
             <sql: 'SELECT * FROM foo'>
@@ -812,12 +1521,21 @@ class DB:
 
         if _test:
             return sql_query
+        elif stream:
+            return self._stream(sql_query, stream, row_type)
 
         db_cursor = self._db_cursor()
         self._db_execute(db_cursor, sql_query)
 
+        if db_cursor.description and self.has_pooling and not self.ctx.transactions:
+            # the connection goes back to the pool on commit, where another
+            # thread may use it before the rows are read: read them first.
+            cursor, rows = db_cursor, db_cursor.fetchall()
+            db_cursor = _FetchedCursor(cursor.description, rows, cursor.rowcount)
+            cursor.close()
+
         if db_cursor.description:
-            out = self.create_result_set(db_cursor)
+            out = self.create_result_set(db_cursor, row_type)
         else:
             out = db_cursor.rowcount
 
@@ -825,10 +1543,34 @@ class DB:
             self.ctx.commit()
         return out
 
-    def create_result_set(self, cursor):
-        return ResultSet(cursor)
+    def create_result_set(self, cursor, row_type=None):
+        return ResultSet(cursor, row_type=row_type)
+
+    def _stream(self, sql_query, batch_size, row_type):
+        ctx = self.ctx
+        db_cursor = self._db_stream_cursor()
+        self._db_execute(db_cursor, sql_query)
 
-    def select(
+        def close(result):
+            # the connection is kept until the last stream is closed. Queries
+            # made in the meantime are committed as usual, and so is this one
+            # once it is closed, unless it was made in a transaction.
+            if result in ctx.get("streams", ()):
+                ctx.streams.remove(result)
+                if not ctx.transactions:
+                    ctx.commit()
+
+        if batch_size is True:
+            batch_size = StreamResultSet.batch_size
+        result = StreamResultSet(db_cursor, batch_size, close, row_type)
+        ctx.streams.append(result)
+        return result
+
+    def _db_stream_cursor(self):
+        """Returns a server-side cursor, for streaming the rows of a query."""
+        return self._db_cursor()
+
+    def select(  # noqa: PLR0913, PLR0917
         self,
         tables,
         vars=None,
@@ -839,11 +1581,14 @@ class DB:
         limit=None,
         offset=None,
         _test=False,
+        stream=False,
+        row_type=None,
     ):
         """
         Selects `what` from `tables` with clauses `where`, `order`,
         `group`, `limit`, and `offset`. Uses vars to interpolate.
-        Otherwise, each clause can be a SQLQuery.
+        Otherwise, each clause can be a SQLQuery. `stream` and `row_type`
+        are passed to `query`.
 
             >>> db = DB(None, {})
             >>> db.select('foo', _test=True)
@@ -856,18 +1601,24 @@ class DB:
         if vars is None:
             vars = {}
 
-        sql_clauses = self.sql_clauses(what, tables, where, group, order, limit, offset)
-        clauses = [
-            self.gen_clause(sql, val, vars)
-            for sql, val in sql_clauses
+        sql_clauses = [
+            (sql, val)
+            for sql, val in self.sql_clauses(
+                what, tables, where, group, order, limit, offset
+            )
             if val is not None
         ]
-        qout = SQLQuery.join(clauses)
+
+        def build():
+            clauses = [self.gen_clause(sql, val, vars) for sql, val in sql_clauses]
+            return SQLQuery.join(clauses)
+
+        qout = self._statement(build, "SELECT", *sql_clauses, vars=vars)
 
         if _test:
             return qout
 
-        return self.query(qout, processed=True)
+        return self.query(qout, processed=True, stream=stream, row_type=row_type)
 
     def where(
         self,
@@ -891,7 +1642,6 @@ class DB:
             >>> db.where('foo', _test=True)
             <sql: 'SELECT * FROM foo'>
         """
-        where = self._where_dict(kwargs)
         return self.select(
             table,
             what=what,
@@ -900,9 +1650,42 @@ class DB:
             limit=limit,
             offset=offset,
             _test=_test,
-            where=where,
+            where=kwargs or None,
         )
 
+    def _statement(self, build, *clauses, vars):
+        """Returns the query built by calling `build`.
+
+        The query is made from a cached statement when there is one for the
+        shape of its `clauses`, which are (sql, value) pairs.
+        """
+        key = [clauses[0]]
+        values = []
+        for sql, val in clauses[1:]:
+            shape = _clause_shape(sql, val, vars) if val is not None else ((), [])
+            if shape is None:
+                return build()
+            key.append((sql, shape[0]))
+            values += shape[1]
+
+        key = tuple(key)
+        try:
+            statement = self._statements.get(key)
+        except TypeError:  # unhashable
+            return build()
+
+        if statement is None:
+            query = build()
+            params = query.values()
+            if len(params) != len(values) or any(
+                a is not b for a, b in zip(params, values)
+            ):
+                return query
+            if len(self._statements) >= 1024:
+                self._statements.clear()
+            statement = self._statements[key] = _Statement(query)
+        return statement.bind(values)
+
     def sql_clauses(self, what, tables, where, group, order, limit, offset):
         return (
             ("SELECT", what),
@@ -1003,37 +1786,77 @@ class DB:
     def _get_insert_default_values_query(self, table):
         return "INSERT INTO %s DEFAULT VALUES" % table
 
-    def multiple_insert(self, tablename, values, seqname=None, _test=False):
+    def multiple_insert(
+        self, tablename, values, seqname=None, _test=False, chunk_size=None
+    ):
         """
-        Inserts multiple rows into `tablename`. The `values` must be a list of
-        dictionaries, one for each row to be inserted, each with the same set
-        of keys. Returns the list of ids of the inserted rows.
+        Inserts multiple rows into `tablename`. The `values` must be an
+        iterable of dictionaries, one for each row to be inserted, each with
+        the same set of keys. Returns the list of ids of the inserted rows.
         Set `seqname` to the ID if it's not the default, or to `False`
         if there isn't one.
 
+        The rows are inserted in a single transaction, `chunk_size` rows per
+        query. By default, a query takes as many rows as the database allows
+        params in a query. `values` can also be a generator, which is consumed
+        one chunk at a time.
+
             >>> db = DB(None, {})
             >>> db.supports_multiple_insert = True
             >>> values = [{"name": "foo", "email": "foo@example.com"}, {"name": "bar", "email": "bar@example.com"}]
             >>> db.multiple_insert('person', values=values, _test=True)
             <sql: "INSERT INTO person (email, name) VALUES ('foo@example.com', 'foo'), ('bar@example.com', 'bar')">
         """
-        if not values:
+        rows = iter(values)
+        first = next(rows, None)
+        if first is None:
             return []
+        rows = itertools.chain([first], rows)
 
-        if not self.supports_multiple_insert:
-            out = [
-                self.insert(tablename, seqname=seqname, _test=_test, **v)
-                for v in values
-            ]
-            if seqname is False:
-                return None
-            else:
-                return out
+        if _test:
+            if not self.supports_multiple_insert:
+                return [
+                    self.insert(tablename, seqname=seqname, _test=_test, **v)
+                    for v in rows
+                ]
+            return self._multiple_insert_query(tablename, first.keys(), list(rows))
+
+        if chunk_size is None:
+            chunk_size = max(self.max_params // max(len(first), 1), 1)
+
+        out = []
+        transaction = self.transaction() if not self.ctx.transactions else None
+        try:
+            multiple = self.supports_multiple_insert and (
+                seqname is False or self._has_range_ids(tablename, first.keys())
+            )
+            for chunk in group(rows, chunk_size):
+                if multiple:
+                    ids = self._multiple_insert_chunk(
+                        tablename, first.keys(), chunk, seqname
+                    )
+                elif seqname is False:
+                    ids = self._executemany_insert(tablename, first.keys(), chunk)
+                else:
+                    ids = [self.insert(tablename, seqname=seqname, **v) for v in chunk]
 
-        keys = values[0].keys()
-        # @@ make sure all keys are valid
+                if ids is None:
+                    out = None
+                elif out is not None:
+                    out.extend(ids)
+        except:
+            if transaction:
+                transaction.rollback()
+            raise
+        if transaction:
+            transaction.commit()
 
-        for v in values:
+        if seqname is False:
+            return None
+        return out
+
+    def _multiple_insert_query(self, tablename, keys, rows):
+        for v in rows:
             if v.keys() != keys:
                 raise ValueError("Not all rows have the same keys")
 
@@ -1044,7 +1867,7 @@ class DB:
             "INSERT INTO {} ({}) VALUES ".format(tablename, ", ".join(keys))
         )
 
-        for i, row in enumerate(values):
+        for i, row in enumerate(rows):
             if i != 0:
                 sql_query.append(", ")
             SQLQuery.join(
@@ -1054,9 +1877,26 @@ class DB:
                 prefix="(",
                 suffix=")",
             )
+        return sql_query
 
-        if _test:
-            return sql_query
+    def _has_range_ids(self, tablename, keys):
+        """Tells if the ids of rows with `keys` inserted in one query into
+        `tablename` are a range, computed by `_multiple_insert_chunk`.
+        """
+        return True
+
+    def _multiple_insert_chunk(self, tablename, keys, rows, seqname):
+        """Inserts `rows` with one query and returns their ids."""
+        params = self._insert_params(keys, rows)
+        if params is None:
+            sql_query = self._multiple_insert_query(tablename, keys, rows)
+        else:
+            key = ("INSERT", tablename, tuple(keys), len(rows))
+            statement = self._statements.get(key)
+            if statement is None:
+                sql_query = self._multiple_insert_query(tablename, keys, rows)
+                statement = self._statements[key] = _Statement(sql_query)
+            sql_query = statement.bind(params)
 
         db_cursor = self._db_cursor()
         if seqname is not False:
@@ -1077,15 +1917,48 @@ class DB:
             # MySQL gives the first id of multiple inserted rows.
             # PostgreSQL and SQLite give the last id.
             if self.db_module.__name__ in mysql_drivers:
-                out = range(out, out + len(values))
+                return range(out, out + len(rows))
             else:
-                out = range(out - len(values) + 1, out + 1)
+                return range(out - len(rows) + 1, out + 1)
         except Exception:
-            out = None
+            return None
 
-        if not self.ctx.transactions:
-            self.ctx.commit()
-        return out
+    def _executemany_insert(self, tablename, keys, rows):
+        """Inserts `rows` with the executemany method of the cursor."""
+        params = self._insert_params(keys, rows)
+        if params is None:
+            for v in rows:
+                self.insert(tablename, seqname=False, **v)
+            return None
+
+        sql_query = self._multiple_insert_query(tablename, keys, rows[:1])
+        query, _ = self._process_query(sql_query)
+        n = len(keys)
+        params = [params[i : i + n] for i in range(0, len(params), n)]
+
+        self.ctx.dbq_count += 1
+        db_cursor = self._db_cursor()
+        a = time.perf_counter()
+        db_cursor.executemany(query, params)
+        b = time.perf_counter()
+
+        self._log_query(db_cursor, sql_query, query, len(params) * n, b - a)
+        return None
+
+    def _insert_params(self, keys, rows):
+        """Returns the values of `rows` in the order of their params in the
+        insert query, or None if some of them are `SQLLiteral`s.
+        """
+        params = []
+        order = sorted(keys)
+        for v in rows:
+            if v.keys() != keys:
+                raise ValueError("Not all rows have the same keys")
+            params.extend(v[k] for k in order)
+
+        if any(isinstance(x, SQLLiteral) for x in params):
+            return None
+        return params
 
     def update(self, tables, where, vars=None, _test=False, **values):
         """
@@ -1106,16 +1979,23 @@ class DB:
         if vars is None:
             vars = {}
 
-        where = self._where(where, vars)
-        values = sorted(values.items(), key=lambda t: t[0])
+        def build():
+            return (
+                "UPDATE "
+                + sqllist(tables)
+                + " SET "
+                + sqlwhere(sorted(values.items(), key=lambda t: t[0]), ", ")
+                + " WHERE "
+                + self._where(where, vars)
+            )
 
-        query = (
-            "UPDATE "
-            + sqllist(tables)
-            + " SET "
-            + sqlwhere(values, ", ")
-            + " WHERE "
-            + where
+        query = self._statement(
+            build,
+            "UPDATE",
+            ("", sqllist(tables)),
+            ("SET", values),
+            ("WHERE", where),
+            vars=vars,
         )
 
         if _test:
@@ -1139,14 +2019,24 @@ class DB:
         if vars is None:
             vars = {}
 
-        where = self._where(where, vars)
+        def build():
+            q = "DELETE FROM " + table
+            if using:
+                q += " USING " + sqllist(using)
 
-        q = "DELETE FROM " + table
-        if using:
-            q += " USING " + sqllist(using)
+            w = self._where(where, vars)
+            if w:
+                q += " WHERE " + w
+            return q
 
-        if where:
-            q += " WHERE " + where
+        q = self._statement(
+            build,
+            "DELETE",
+            ("", table),
+            ("USING", using and sqllist(using)),
+            ("WHERE", where),
+            vars=vars,
+        )
 
         if _test:
             return q
@@ -1165,6 +2055,9 @@ class DB:
         return Transaction(self.ctx)
 
 
+_cursor_ids = itertools.count()
+
+
 class PostgresDB(DB):
     """Postgres driver."""
 
@@ -1187,6 +2080,7 @@ class PostgresDB(DB):
         self.paramstyle = db_module.paramstyle
         DB.__init__(self, db_module, keywords)
         self.supports_multiple_insert = True
+        self.max_params = 32767
         self._sequences = None
 
     def _process_insert_query(self, query, tablename, seqname):
@@ -1221,10 +2115,14 @@ class PostgresDB(DB):
         conn.set_client_encoding("UTF8")
         return conn
 
-    def _connect_with_pooling(self, keywords):
-        conn = DB._connect_with_pooling(self, keywords)
-        conn._con._con.set_client_encoding("UTF8")
-        return conn
+    def _db_stream_cursor(self):
+        # named cursors of psycopg2 are server-side cursors. withhold keeps
+        # them open when queries made while reading the rows are committed,
+        # but the server then computes and stores the rows left to read on
+        # that commit, like a query without stream=True would.
+        return self.ctx.db.cursor(
+            name="webpy_cursor_%d" % next(_cursor_ids), withhold=True
+        )
 
 
 class MySQLDB(DB):
@@ -1257,6 +2155,7 @@ class MySQLDB(DB):
         self.dbname = "mysql"
         DB.__init__(self, db, keywords)
         self.supports_multiple_insert = True
+        self.max_params = 65535
 
     def _process_insert_query(self, query, tablename, seqname):
         return query, SQLQuery("SELECT last_insert_id();")
@@ -1264,6 +2163,13 @@ class MySQLDB(DB):
     def _get_insert_default_values_query(self, table):
         return "INSERT INTO %s () VALUES()" % table
 
+    def _db_stream_cursor(self):
+        if self.db_module.__name__ == "mysql.connector":
+            return self.ctx.db.cursor(buffered=False)
+        else:
+            cursors = importlib.import_module(self.db_module.__name__ + ".cursors")
+            return self.ctx.db.cursor(cursors.SSCursor)
+
 
 def import_driver(drivers, preferred=None):
     """Import the first available driver or preferred driver."""
@@ -1295,16 +2201,33 @@ class SqliteDB(DB):
         self.paramstyle = db.paramstyle
         keywords["database"] = keywords.pop("db")
 
-        # sqlite don't allows connections to be shared by threads
-        keywords["pooling"] = False
+        # sqlite connections can't be shared by threads, unless they are
+        # pooled, which makes sure only one thread uses them at a time.
+        if keywords.setdefault("pooling", False) and db.__name__ == "sqlite3":
+            keywords.setdefault("check_same_thread", False)
 
         DB.__init__(self, db, keywords)
+        self.supports_multiple_insert = True
 
     def _process_insert_query(self, query, tablename, seqname):
         return query, SQLQuery("SELECT last_insert_rowid();")
 
-    def create_result_set(self, cursor):
-        return SqliteResultSet(cursor)
+    def _has_range_ids(self, tablename, keys):
+        # rows given their own rowid, or INTEGER PRIMARY KEY, are inserted one
+        # by one, to return their actual ids.
+        try:
+            columns = self.query("PRAGMA table_info(%s)" % tablename).list()
+        except Exception:
+            return False
+
+        rowid = {"rowid", "oid", "_rowid_"}
+        pk = [c for c in columns if c.pk]
+        if len(pk) == 1 and pk[0].type.upper() == "INTEGER":
+            rowid.add(pk[0].name.lower())
+        return not rowid & {k.lower() for k in keys}
+
+    def create_result_set(self, cursor, row_type=None):
+        return SqliteResultSet(cursor, row_type=row_type)
 
 
 class FirebirdDB(DB):
@@ -1412,6 +2335,129 @@ class OracleDB(DB):
             return query + "; SELECT %s.currval FROM dual" % seqname
 
 
+class RoutingDB:
+    """Database sending reads to replicas and everything else to a primary.
+
+    `select`, `where` and `query` calls with a SELECT query go to one of the
+    `replicas`, taken in turn with `routing="round-robin"`, or the one
+    running the fewest queries with `routing="least-busy"`. Writes and
+    transactions go to the `primary`. Once there was a write, the reads of
+    the thread also go to the primary, so that they see the write, until the
+    end of the request, when web.py clears the thread-local state.
+
+    The other attributes are the ones of the primary.
+    """
+
+    def __init__(self, primary, replicas, routing="round-robin"):
+        if routing not in ["round-robin", "least-busy"]:
+            raise ValueError("unknown routing: %r" % routing)
+
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.routing = routing
+
+        self._ctx = ThreadedDict()
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+        self._busy = [0] * len(self.replicas)
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def _on_primary(self):
+        return (
+            not self.replicas
+            or self._ctx.get("sticky")
+            or self.primary._ctx.get("transactions")
+        )
+
+    def _read(self, method, *args, **kwargs):
+        if self._on_primary():
+            return getattr(self.primary, method)(*args, **kwargs)
+
+        with self._lock:
+            if self.routing == "round-robin":
+                i = next(self._turns) % len(self.replicas)
+            else:
+                i = self._busy.index(min(self._busy))
+            self._busy[i] += 1
+        try:
+            return getattr(self.replicas[i], method)(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._busy[i] -= 1
+
+    def _write(self, method, *args, **kwargs):
+        if not kwargs.get("_test"):
+            self._ctx.sticky = True
+        return getattr(self.primary, method)(*args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._read("select", *args, **kwargs)
+
+    def where(self, *args, **kwargs):
+        return self._read("where", *args, **kwargs)
+
+    def query(self, sql_query, *args, **kwargs):
+        if isinstance(sql_query, SQLQuery):
+            text = "".join(x for x in sql_query.items if isinstance(x, str))
+        else:
+            text = sql_query
+
+        if _read_query.match(text) and not _write_clause.search(text):
+            return self._read("query", sql_query, *args, **kwargs)
+        else:
+            return self._write("query", sql_query, *args, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self._write("insert", *args, **kwargs)
+
+    def multiple_insert(self, *args, **kwargs):
+        return self._write("multiple_insert", *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._write("update", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._write("delete", *args, **kwargs)
+
+    def transaction(self):
+        """Start a transaction on the primary."""
+        self._ctx.sticky = True
+        return self.primary.transaction()
+
+
+_read_query = re.compile(r"\s*SELECT\b", re.I)
+_write_clause = re.compile(r"\bINTO\b|\bFOR\s+(UPDATE|SHARE)\b", re.I)
+
+
+class _FetchedCursor:
+    """Cursor-like holder of the rows of a query already fetched, by an async
+    driver or before a pooled connection is released, for making a
+    `ResultSet` of them.
+    """
+
+    def __init__(self, description, rows, rowcount):
+        self.description = description
+        self.rows = collections.deque(rows)
+        # the drivers don't all count the rows of a SELECT.
+        self.rowcount = len(self.rows) if description else rowcount
+
+    def fetchone(self):
+        return self.rows.popleft() if self.rows else None
+
+    def fetchmany(self, size):
+        return [self.rows.popleft() for _ in range(min(size, len(self.rows)))]
+
+    def fetchall(self):
+        rows = list(self.rows)
+        self.rows.clear()
+        return rows
+
+    def close(self):
+        self.rows.clear()
+
+
 def dburl2dict(url):
     """
     Takes a URL to a database and parses it into an equivalent dictionary.
@@ -1449,12 +2495,23 @@ def dburl2dict(url):
 _databases = {}
 
 
-def database(dburl=None, **params):
+def database(dburl=None, replicas=None, routing="round-robin", **params):
     """Creates appropriate database using params.
 
-    Pooling will be enabled if DBUtils module is available.
-    Pooling can be disabled by passing pooling=False in params.
+    Connections are pooled when passing pooling=True in params; see
+    `ConnectionPool` for the `pool_*` params to tune it.
+
+    With `replicas`, a list of database urls or of dicts of params, returns
+    a `RoutingDB` that sends reads to the replicas, with `routing`, and
+    writes to this database.
     """
+    if replicas:
+        return RoutingDB(
+            database(dburl, **params),
+            [database(**r) if isinstance(r, dict) else database(r) for r in replicas],
+            routing,
+        )
+
     if not dburl and not params:
         dburl = os.environ["DATABASE_URL"]
 
@@ -1675,12 +2732,37 @@ class Parser:
         return expr
 
 
+@functools.lru_cache(maxsize=1024)
+def _parse(text):
+    """Returns the nodes of template `text`, leaving out empty texts."""
+    return tuple(
+        node for node in Parser().parse(text) if node.type != "text" or node.first
+    )
+
+
 class SafeEval:
-    """Safe evaluator for binding params to db queries."""
+    """Safe evaluator for binding params to db queries.
+
+    Parsed templates are cached, so evaluating a template again only has to
+    look up the values of its params.
+    """
 
     def safeeval(self, text, mapping):
-        nodes = Parser().parse(text)
-        return SQLQuery.join([self.eval_node(node, mapping) for node in nodes], "")
+        items = []
+        for node in _parse(text):
+            if node.type == "text":
+                items.append(node.first)
+                continue
+            elif node.type == "param":
+                value = mapping[node.first]
+            else:
+                value = self.eval_expr(node, mapping)
+
+            if isinstance(value, (list, tuple, set)):
+                items.extend(_sqllist(value).items)
+            else:
+                items.append(SQLParam(value))
+        return SQLQuery(items)
 
     def eval_node(self, node, mapping):
         if node.type == "text":
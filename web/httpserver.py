@@ -1,6 +1,10 @@
+import email.utils
 import os
 import posixpath
+import re
+import stat
 import sys
+import time
 from http.server import BaseHTTPRequestHandler, HTTPServer, SimpleHTTPRequestHandler
 from io import BytesIO
 from urllib.parse import unquote, urlparse
@@ -178,8 +182,76 @@ def WSGIServer(server_address, wsgi_app):
     return server
 
 
+class _StatCache:
+    """Cache of `os.stat` results, each kept for `ttl` seconds."""
+
+    def __init__(self, ttl=1.0, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self.cache = {}
+
+    def stat(self, path):
+        """Returns the stat of `path`, or None if it doesn't exist."""
+        now = time.monotonic()
+        entry = self.cache.get(path)
+        if entry and entry[0] > now:
+            return entry[1]
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if len(self.cache) >= self.size:
+            self.cache.clear()
+        self.cache[path] = (now + self.ttl, st)
+        return st
+
+    def forget(self, path):
+        """Drops the cached stat of `path`."""
+        self.cache.pop(path, None)
+
+
+def _parse_range(header, size):
+    """Returns the (start, end) offsets of the single byte range in `header`,
+    with `end` exclusive, or None for a value that isn't supported. Raises
+    ValueError if the range can't be satisfied.
+
+        >>> _parse_range("bytes=0-99", 1000), _parse_range("bytes=900-", 1000)
+        ((0, 100), (900, 1000))
+        >>> _parse_range("bytes=-100", 1000), _parse_range("bytes=0-1,5-6", 1000)
+        ((900, 1000), None)
+    """
+    m = re.match(r"bytes=(\d*)-(\d*)$", header.strip())
+    if not m or m.group(1) == m.group(2) == "":
+        return None
+    elif m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)) + 1, size) if m.group(2) else size
+    else:
+        start, end = max(size - int(m.group(2)), 0), size
+
+    if start >= end:
+        raise ValueError("unsatisfiable range: %s" % header)
+    return start, end
+
+
 class StaticApp(SimpleHTTPRequestHandler):
-    """WSGI application for serving static files."""
+    """WSGI application for serving static files.
+
+    Files are sent with the `wsgi.file_wrapper` of the server, if it has one,
+    so that it can use `os.sendfile`. cheroot, the server of `runsimple`, has
+    none, and files are read in blocks of `block_size` bytes then. Requests for a single byte range get a
+    `206 Partial Content` response, and a `.br` or `.gz` file next to the
+    requested one is sent instead if the client accepts that encoding.
+    """
+
+    block_size = 16 * 1024
+
+    # encodings of precompressed files, in the order of preference.
+    encodings = [("br", ".br"), ("gzip", ".gz")]
+
+    stat_cache = _StatCache()
 
     def __init__(self, environ, start_response):
         self.headers = []
@@ -201,6 +273,10 @@ class StaticApp(SimpleHTTPRequestHandler):
         pass
 
     def __iter__(self):
+        return iter(self.respond())
+
+    def respond(self):
+        """Starts the response and returns an iterable with its body."""
         environ = self.environ
 
         self.path = environ.get("PATH_INFO", "")
@@ -212,32 +288,150 @@ class StaticApp(SimpleHTTPRequestHandler):
 
         self.wfile = BytesIO()  # for capturing error
 
+        path = self.translate_path(self.path)
+        st = self.stat_cache.stat(path)
+        if st is None or not stat.S_ISREG(st.st_mode) or path.endswith("/"):
+            # directories and missing files
+            return self.respond_send_head()
+
+        ctype = self.guess_type(path)
+        path, _, encoding, vary = self.select_encoding(path, st)
         try:
-            path = self.translate_path(self.path)
-            etag = '"%s"' % os.path.getmtime(path)
-            client_etag = environ.get("HTTP_IF_NONE_MATCH")
-            self.send_header("ETag", etag)
-            if etag == client_etag:
-                self.send_response(304, "Not Modified")
-                self.start_response(self.status, self.headers)
-                return
+            f = open(path, "rb")
         except OSError:
-            pass  # Probably a 404
+            # removed or made unreadable since it was stat'ed.
+            self.stat_cache.forget(path)
+            return self.respond_send_head()
+        return self.respond_file(f, ctype, encoding, vary)
+
+    def respond_file(self, f, ctype, encoding, vary):
+        """Starts the response for the open file `f`, with the content type
+        `ctype` and the `encoding` picked by `select_encoding`.
+        """
+        # the cached stat may be outdated, the headers must match what is sent.
+        st = os.fstat(f.fileno())
+        etag = '"%s"' % st.st_mtime
+        if encoding:
+            etag = '"%s-%s"' % (st.st_mtime, encoding)
+
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(st.st_mtime))
+        if vary:
+            self.send_header("Vary", "Accept-Encoding")
+
+        if self.not_modified(etag, st.st_mtime):
+            f.close()
+            self.send_response(304, "Not Modified")
+            self.start_response(self.status, self.headers)
+            return []
+
+        self.send_header("Content-Type", ctype)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Accept-Ranges", "bytes")
+
+        size = st.st_size
+        try:
+            start, end = self.byte_range(size, etag)
+        except ValueError:
+            f.close()
+            self.send_response(416, "Range Not Satisfiable")
+            self.send_header("Content-Range", "bytes */%d" % size)
+            self.send_header("Content-Length", "0")
+            self.start_response(self.status, self.headers)
+            return []
+
+        if start == 0 and end == size:
+            self.send_response(200, "OK")
+        else:
+            self.send_response(206, "Partial Content")
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, size))
+        self.send_header("Content-Length", str(end - start))
+        self.start_response(self.status, self.headers)
 
+        if self.command == "HEAD":
+            f.close()
+            return []
+
+        file_wrapper = self.environ.get("wsgi.file_wrapper")
+        if file_wrapper and start == 0 and end == size:
+            return file_wrapper(f, self.block_size)
+        f.seek(start)
+        return self.read(f, end - start)
+
+    def select_encoding(self, path, st):
+        """Picks the precompressed version of the file at `path` to send.
+
+        Returns the path and stat of the file, its encoding (None for the
+        file itself) and whether there are precompressed versions of it.
+        """
+        selected = path, st, None
+        vary = False
+        for name, suffix in self.encodings:
+            encoded = self.stat_cache.stat(path + suffix)
+            if encoded is None or not stat.S_ISREG(encoded.st_mode):
+                continue
+            vary = True
+            if selected[2] is None and self.accepts_encoding(name):
+                selected = path + suffix, encoded, name
+        return selected + (vary,)
+
+    def byte_range(self, size, etag):
+        """Returns the (start, end) offsets of the part of the file to send,
+        from the `Range` header of the request. Raises ValueError if the
+        range can't be satisfied.
+        """
+        range_header = self.environ.get("HTTP_RANGE")
+        if_range = self.environ.get("HTTP_IF_RANGE")
+        if range_header and (not if_range or if_range == etag):
+            return _parse_range(range_header, size) or (0, size)
+        return 0, size
+
+    def respond_send_head(self):
         f = self.send_head()
         self.start_response(self.status, self.headers)
 
         if f:
-            block_size = 16 * 1024
-            while True:
-                buf = f.read(block_size)
+            return self.read(f, os.fstat(f.fileno()).st_size)
+        else:
+            return [self.wfile.getvalue()]
+
+    def read(self, f, length):
+        """Yields `length` bytes from file `f` in blocks and closes it."""
+        try:
+            while length > 0:
+                buf = f.read(min(self.block_size, length))
                 if not buf:
                     break
+                length -= len(buf)
                 yield buf
+        finally:
             f.close()
-        else:
-            value = self.wfile.getvalue()
-            yield value
+
+    def accepts_encoding(self, encoding):
+        for value in self.environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+            name, _, params = value.partition(";")
+            if name.strip().lower() == encoding:
+                return params.replace(" ", "") not in ["q=0", "q=0.0", "q=0.00"]
+        return False
+
+    def not_modified(self, etag, mtime):
+        """Tells if the client has the current version of the file,
+        according to its `If-None-Match` or `If-Modified-Since` header.
+        """
+        if_none_match = self.environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+
+        if_modified_since = self.environ.get("HTTP_IF_MODIFIED_SINCE")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
 
 
 class StaticMiddleware:
@@ -252,7 +446,7 @@ class StaticMiddleware:
         path = self.normpath(path)
 
         if path.startswith(self.prefix):
-            return StaticApp(environ, start_response)
+            return StaticApp(environ, start_response).respond()
         else:
             return self.app(environ, start_response)
 
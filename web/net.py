@@ -21,6 +21,7 @@ __all__ = [
     "htmlquote",
     "htmlunquote",
     "websafe",
+    "SafeHTML",
 ]
 
 
@@ -223,11 +224,18 @@ def htmlquote(text):
         >>> htmlquote(u"<'&\">")
         u'&lt;&#39;&amp;&quot;&gt;'
     """
-    text = text.replace("&", "&amp;")  # Must be done first!
-    text = text.replace("<", "&lt;")
-    text = text.replace(">", "&gt;")
-    text = text.replace("'", "&#39;")
-    text = text.replace('"', "&quot;")
+    # looking for a char is much faster than replacing it, and most text
+    # has none of them.
+    if "&" in text:
+        text = text.replace("&", "&amp;")  # Must be done first!
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "'" in text:
+        text = text.replace("'", "&#39;")
+    if '"' in text:
+        text = text.replace('"', "&quot;")
     return text
 
 
@@ -246,9 +254,25 @@ def htmlunquote(text):
     return text
 
 
+class SafeHTML(str):
+    """
+    String of HTML that is used as is by `websafe`, and by templates, instead
+    of being quoted again.
+
+        >>> websafe(SafeHTML("<b>bold</b>"))
+        '<b>bold</b>'
+    """
+
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+
 def websafe(val):
     r"""
-    Converts `val` so that it is safe for use in Unicode HTML.
+    Converts `val` so that it is safe for use in Unicode HTML. Objects
+    with an `__html__` method, like `SafeHTML`, give their own HTML.
 
         >>> websafe("<'&\">")
         u'&lt;&#39;&amp;&quot;&gt;'
@@ -257,8 +281,16 @@ def websafe(val):
         >>> websafe(u'\u203d') == u'\u203d'
         True
     """
-    if val is None:
+    t = type(val)
+    if t is str:
+        return htmlquote(val)
+    elif t is int or t is float:
+        # no special chars in numbers
+        return str(val)
+    elif val is None:
         return ""
+    elif hasattr(val, "__html__"):
+        return val.__html__()
 
     if isinstance(val, bytes):
         val = val.decode("utf-8")
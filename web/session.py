@@ -13,6 +13,7 @@ import time
 from base64 import decodebytes, encodebytes
 from copy import deepcopy
 from hashlib import sha1
+from inspect import isawaitable
 
 from . import utils
 from . import webapi as web
@@ -92,7 +93,23 @@ class Session:
         self._load()
 
         try:
-            return handler()
+            result = handler()
+        except:
+            self._save()
+            raise
+
+        if isawaitable(result):
+            return self._save_after(result)
+        self._save()
+        return result
+
+    # coroutine handlers are awaited without holding a thread, see application.asgifunc
+    _processor.async_aware = True
+
+    async def _save_after(self, result):
+        # the session is saved in the event loop, once the coroutine handler is done.
+        try:
+            return await result
         finally:
             self._save()
 
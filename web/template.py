@@ -31,16 +31,21 @@ Grammar:
 import ast
 import builtins
 import glob
+import hashlib
+import importlib.util
 import itertools
+import json
+import marshal
 import os
 import sys
+import tempfile
 import token
 import tokenize
 from functools import partial
 
 from more_itertools import peekable
 
-from .net import websafe
+from .net import SafeHTML, websafe
 from .utils import re_compile, safestr, safeunicode, storage
 from .webapi import config
 
@@ -615,11 +620,56 @@ class LineNode:
         self.nodes = nodes
 
     def emit(self, indent, text_indent="", name=""):
-        text = [node.emit("") for node in self.nodes]
-        if text_indent:
-            text = [repr(text_indent)] + text
-
-        return indent + "extend_([%s])\n" % ", ".join(text)
+        return LineNode.emit_lines([self], indent, text_indent)
+
+    def emit_lines(lines, indent, text_indent=""):
+        r"""Emits consecutive `lines` as a single extend_ call, spanning as
+        many lines of code so that errors still point to the right line.
+        Adjacent text is merged into one string, even across lines.
+
+            >>> lines = Parser().read_suite("<ul>\n<li>$x</li>\n</ul>\n").sections
+            >>> print(LineNode.emit_lines(lines, ""))
+            extend_(['<ul>\n<li>',
+            escape_(x, True), '</li>\n</ul>\n'])
+            <BLANKLINE>
+            <BLANKLINE>
+        """
+        code_lines = []
+        text = None  # the last item, as a list, when it is text
+        for line in lines:
+            items = []
+            nodes = line.nodes
+            if text_indent:
+                nodes = [TextNode(text_indent)] + nodes
+
+            for node in nodes:
+                if not isinstance(node, TextNode):
+                    items.append(node.emit(""))
+                    text = None
+                elif text is not None:
+                    text[0] += safeunicode(node.value)
+                else:
+                    text = [safeunicode(node.value)]
+                    items.append(text)
+            code_lines.append(items)
+
+        # lines left empty by merging their text into previous ones
+        blank = 0
+        while len(code_lines) > 1 and not code_lines[-1]:
+            code_lines.pop()
+            blank += 1
+
+        remaining = sum(len(items) for items in code_lines)
+        out = []
+        for items in code_lines:
+            remaining -= len(items)
+            s = ", ".join(repr(x[0]) if isinstance(x, list) else x for x in items)
+            if items and remaining:
+                s += ","
+            out.append(s)
+        return indent + "extend_([%s])\n" % "\n".join(out) + "\n" * blank
+
+    emit_lines = staticmethod(emit_lines)
 
     def __repr__(self):
         return "<line: %s>" % repr(self.nodes)
@@ -732,7 +782,20 @@ class SuiteNode:
         self.sections = sections
 
     def emit(self, indent, text_indent=""):
-        return "\n" + "".join([s.emit(indent, text_indent) for s in self.sections])
+        # consecutive lines are emitted together, see LineNode.emit_lines
+        out = []
+        lines = []
+        for s in self.sections:
+            if isinstance(s, LineNode):
+                lines.append(s)
+                continue
+            if lines:
+                out.append(LineNode.emit_lines(lines, indent, text_indent))
+                lines = []
+            out.append(s.emit(indent, text_indent))
+        if lines:
+            out.append(LineNode.emit_lines(lines, indent, text_indent))
+        return "\n" + "".join(out)
 
     def __repr__(self):
         return repr(self.sections)
@@ -902,20 +965,43 @@ class BaseTemplate:
             TemplateResult=TemplateResult,
             escape_=self._escape,
             join_=self._join,
+            flush_=self._flush,
         )
 
     def _join(self, *items):
         return "".join(items)
 
     def _escape(self, value, escape=False):
-        if value is None:
+        t = type(value)
+        if t is str:
+            pass
+        elif value is None:
             value = ""
+        elif t is int or t is float:
+            value = str(value)
+        elif not isinstance(value, str):
+            # str subclasses are kept, for filters to leave SafeHTML as is.
+            if hasattr(value, "__html__"):
+                value = SafeHTML(value.__html__())
+            else:
+                value = safeunicode(value)
 
-        value = safeunicode(value)
         if escape and self.filter:
             value = self.filter(value)
         return value
 
+    def _flush(self, result, size):
+        """Takes the output of the TemplateResult `result` once it has more
+        than `size` parts, as a tuple of one UTF-8 encoded chunk, when
+        streaming.
+        """
+        parts = result._parts
+        if len(parts) <= size:
+            return ()
+        chunk = "".join(parts)
+        del parts[:]
+        return (chunk.encode("utf-8"),)
+
 
 class Template(BaseTemplate):
     CONTENT_TYPES = {
@@ -925,6 +1011,8 @@ class Template(BaseTemplate):
     }
     FILTERS = {".html": websafe, ".xhtml": websafe, ".xml": websafe}
     globals = {}
+    # number of parts of the output that make a chunk, when streaming
+    stream_chunk_parts = 500
 
     def __init__(
         self,
@@ -934,10 +1022,15 @@ class Template(BaseTemplate):
         globals=None,
         builtins=None,
         extensions=None,
+        cache_dir=None,
     ):
         self.extensions = extensions or []
+        # directory of the BytecodeCache, defaults to config.template_cache_dir
+        self.cache_dir = cache_dir or config.get("template_cache_dir")
         text = Template.normalize_text(text)
         code = self.compile_template(text, filename)
+        self._text = text
+        self._stream = None
 
         _, ext = os.path.splitext(filename)
         filter = filter or self.FILTERS.get(ext, None)
@@ -983,12 +1076,41 @@ class Template(BaseTemplate):
 
     def __call__(self, *a, **kw):
         __hidetraceback__ = True  # noqa: F841
+        self._set_content_type()
+        return BaseTemplate.__call__(self, *a, **kw)
+
+    def _set_content_type(self):
         from . import webapi as web
 
         if "headers" in web.ctx and self.content_type:
             web.header("Content-Type", self.content_type, unique=True)
 
-        return BaseTemplate.__call__(self, *a, **kw)
+    def stream(self, *a, **kw):
+        """Renders the template like calling it, but returns a generator
+        yielding the output in chunks of UTF-8 encoded bytes, as `$for` and
+        `$while` loops produce it, instead of the whole page at once.
+
+        A handler can return it for the page to be sent while it is being
+        rendered:
+
+            def GET(self):
+                return render.report.stream(rows)
+
+        Templates compiled with `compile_templates`, and templates rendered
+        in a `base` layout by `render`, are rendered at once and the page is
+        yielded as a single chunk.
+        """
+        __hidetraceback__ = True  # noqa: F841
+        if self._stream is None:
+            code = self.compile_template(self._text, self.filename, stream=True)
+            self._stream = self._compile(code) if code else False
+
+        self._set_content_type()
+        if self._stream:
+            return self._stream(*a, **kw)
+        return iter(
+            [safeunicode(BaseTemplate.__call__(self, *a, **kw)).encode("utf-8")]
+        )
 
     def generate_code(text, filename, parser=None):
         # parse the text
@@ -1007,7 +1129,14 @@ class Template(BaseTemplate):
             p = ext(p)
         return p
 
-    def compile_template(self, template_string, filename):
+    def compile_template(self, template_string, filename, stream=False):
+        cache = None if stream else BytecodeCache.get(self.cache_dir)
+        if cache:
+            key = cache.key(template_string, filename, self.extensions)
+            compiled_code = cache.load(key)
+            if compiled_code is not None:
+                return compiled_code
+
         code = Template.generate_code(
             template_string, filename, parser=self.create_parser()
         )
@@ -1032,15 +1161,151 @@ class Template(BaseTemplate):
         ast_node = ast.parse(code, filename)
         SafeVisitor().walk(ast_node, filename)
 
+        if stream:
+            ast_node = StreamTransformer(self.stream_chunk_parts).visit(ast_node)
+            compiled_code = compile(ast_node, filename, "exec")
+
+        if cache:
+            cache.dump(key, compiled_code)
         return compiled_code
 
 
+class StreamTransformer(ast.NodeTransformer):
+    """Turns the code generated for a template into a generator function,
+    for `Template.stream`.
+
+    The output collected in the TemplateResult is yielded at the end of the
+    iterations of loops, once there are more than `chunk_parts` parts of it,
+    and before returning. Functions defined with `$def` are left as they are.
+    """
+
+    def __init__(self, chunk_parts):
+        self.chunk_parts = chunk_parts
+
+    def flush(self, node, size):
+        # yield from flush_(self, size)
+        call = ast.Call(
+            func=ast.Name(id="flush_", ctx=ast.Load()),
+            args=[ast.Name(id="self", ctx=ast.Load()), ast.Constant(value=size)],
+            keywords=[],
+        )
+        return ast.fix_missing_locations(
+            ast.copy_location(ast.Expr(value=ast.YieldFrom(value=call)), node)
+        )
+
+    def visit_FunctionDef(self, node):
+        if node.name != "__template__":
+            return node
+        self.generic_visit(node)
+        return node
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        node.body.append(self.flush(node.body[-1], self.chunk_parts))
+        return node
+
+    visit_While = visit_For
+
+    def visit_Return(self, node):
+        return [self.flush(node, 0), node]
+
+
+class BytecodeCache:
+    """Cache of compiled templates in `directory`, shared by processes.
+
+    Parsing a template, generating its code, compiling it and checking that
+    it is safe is skipped when the cache has the code object of a template
+    with the same text, filename and extensions, for the same versions of
+    web.py and Python and the same source of this module, which generates
+    the code. Code objects are written with `marshal` to temporary
+    files which are renamed, so that concurrent processes never read a
+    partial file.
+
+    As the cached code isn't checked again, the directory must not be
+    writable by anyone else than the application.
+    """
+
+    _instances = {}
+    # hash of the source of this module, see key.
+    _source_hash = None
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(directory):
+        """Returns the cache for `directory`, None if `directory` is None."""
+        if directory is None:
+            return None
+        if directory not in BytecodeCache._instances:
+            BytecodeCache._instances[directory] = BytecodeCache(directory)
+        return BytecodeCache._instances[directory]
+
+    get = staticmethod(get)
+
+    def key(self, text, filename, extensions=()):
+        from . import __version__
+
+        if BytecodeCache._source_hash is None:
+            # the generated code changes with this module, not only with the
+            # releases of web.py.
+            try:
+                with open(__file__, "rb") as f:
+                    BytecodeCache._source_hash = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                BytecodeCache._source_hash = ""
+
+        h = hashlib.sha1(importlib.util.MAGIC_NUMBER)
+        for s in [__version__, BytecodeCache._source_hash, filename, text] + [
+            getattr(ext, "__module__", "") + "." + getattr(ext, "__qualname__", "")
+            for ext in extensions
+        ]:
+            h.update(s.encode("utf-8") + b"\0")
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def load(self, key):
+        """Returns the code object stored for `key`, or None."""
+        try:
+            with open(self.path(key), "rb") as f:
+                return marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def dump(self, key, code):
+        """Stores the code object `code` for `key`. Errors are ignored, as
+        the template can always be compiled again.
+        """
+        try:
+            self.write(key, marshal.dumps(code))
+        except OSError:
+            pass
+
+    def write(self, name, data):
+        """Writes the bytes `data` to the file `name` of the directory,
+        through a temporary file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(name))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
 class CompiledTemplate(Template):
     def __init__(self, f, filename):
         Template.__init__(self, "", filename)
         self.t = f
+        # the text of the template isn't available to generate streaming
+        # code, stream renders the whole page as a single chunk.
+        self._stream = False
 
-    def compile_template(self, *a):
+    def compile_template(self, *a, **kw):
         return None
 
     def _compile(self, *a):
@@ -1137,6 +1402,11 @@ class Render:
             def template(*a, **kw):
                 return self._base(t(*a, **kw))
 
+            def stream(*a, **kw):
+                # the layout takes the whole page, which can't be streamed.
+                return iter([safeunicode(template(*a, **kw)).encode("utf-8")])
+
+            template.stream = stream
             return template
         else:
             return self._template(name)
@@ -1236,6 +1506,66 @@ def compile_templates(root):
         out.close()
 
 
+def precompile_templates(root, out, extensions=None):
+    """Compiles the templates in `root` ahead of time, into the
+    `BytecodeCache` directory `out`. `root` can also be a list of
+    directories, compiled together into `out`.
+
+    Setting `web.config.template_cache_dir` to `out`, `render` loads these
+    templates without compiling them, as long as they are unchanged. The
+    template paths are part of the cache keys, so `root` must be the path
+    given to `render`, relative to the same directory, and `extensions` the
+    same ones.
+
+    The cache files of the templates are listed in `out/manifest.json`,
+    which `render` doesn't read: it tells what was compiled, and the files
+    of the templates listed by the previous manifest that are no longer used
+    are removed. Other files of `out`, like the ones cached by `render`, are
+    kept. Returns the manifest.
+
+        $ python -m web.template compile templates/ --out build/templates
+    """
+    from . import __version__
+
+    roots = [root] if isinstance(root, str) else root
+    cache = BytecodeCache(out)
+    try:
+        with open(cache.path("manifest.json"), encoding="utf-8") as f:
+            previous = json.load(f)["templates"].values()
+    except (OSError, ValueError, KeyError, AttributeError):
+        previous = []
+
+    manifest = {"version": __version__, "templates": {}}
+    walks = itertools.chain.from_iterable(os.walk(r) for r in roots)
+    for dirpath, dirnames, filenames in walks:
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for f in sorted(filenames):
+            if f.startswith(".") or f.endswith("~") or f.startswith("__init__.py"):
+                continue
+
+            path = os.path.join(dirpath, f)
+            with open(path, encoding="utf-8") as tmpl_file:
+                text = tmpl_file.read()
+            # compiling the template saves its code in the cache
+            Template(text, filename=path, extensions=extensions, cache_dir=out)
+
+            key = cache.key(Template.normalize_text(text), path, extensions or [])
+            if not os.path.exists(cache.path(key)):
+                raise OSError("Unable to write the compiled template of " + path)
+            manifest["templates"][path] = key
+
+    keys = set(manifest["templates"].values())
+    for key in set(previous) - keys:
+        if re_compile("^[0-9a-f]{40}$").match(str(key)):
+            try:
+                os.remove(cache.path(key))
+            except FileNotFoundError:
+                pass
+
+    cache.write("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+    return manifest
+
+
 class ParseError(Exception):
     pass
 
@@ -1745,10 +2075,31 @@ def test():
     pass
 
 
+def main(args=None):
+    """Runs the command line of the module:
+
+    $ python -m web.template compile templates/ --out build/templates
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m web.template")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser(
+        "compile", help="compile templates ahead of time, see precompile_templates"
+    )
+    compile_parser.add_argument("roots", nargs="+", metavar="root")
+    compile_parser.add_argument(
+        "--out", required=True, help="the directory of web.config.template_cache_dir"
+    )
+    args = parser.parse_args(args)
+
+    # all the directories share the manifest of out.
+    manifest = precompile_templates(args.roots, args.out)
+    print("%d templates compiled" % len(manifest["templates"]))
+
+
 if __name__ == "__main__":
     if "--compile" in sys.argv:
         compile_templates(sys.argv[2])
     else:
-        import doctest
-
-        doctest.testmod()
+        main()
@@ -4,7 +4,9 @@ General Utilities
 (part of web.py)
 """
 
+import contextvars
 import datetime
+import itertools
 import os
 import re
 import shutil
@@ -548,8 +550,17 @@ def group(seq, size):
         [[1, 2], [3, 4]]
         >>> list(group([1,2,3,4,5], 2))
         [[1, 2], [3, 4], [5]]
+
+    `seq` can also be an iterator, which is consumed one group at a time.
+
+        >>> list(group(iter(range(5)), 2))
+        [[0, 1], [2, 3], [4]]
     """
-    return (seq[i : i + size] for i in range(0, len(seq), size))
+    if hasattr(seq, "__getitem__") and hasattr(seq, "__len__"):
+        return (seq[i : i + size] for i in range(0, len(seq), size))
+
+    it = iter(seq)
+    return iter(lambda: list(itertools.islice(it, size)), [])
 
 
 def uniq(seq, key=None):
@@ -1258,6 +1269,26 @@ class ThreadedDict(threadlocal):
         >>> t.join()
         >>> d.x
         1
+
+    The values can be kept per context instead, using `contextvars`, which is
+    required when requests are handled by asyncio tasks or greenlets rather than
+    threads. `ThreadedDict.use_contextvars()` does that in every thread and is
+    called at startup. `ThreadedDict.use_context()` does it only in the current
+    context, as `application.asgifunc` does for each request.
+
+        >>> import asyncio
+        >>> async def f(x):
+        ...     ThreadedDict.use_context()
+        ...     d.x = x
+        ...     await asyncio.sleep(0)
+        ...     return d.x
+        >>> async def main():
+        ...     return await asyncio.gather(f(1), f(2))
+        >>> asyncio.run(main())
+        [1, 2]
+
+    Functions run with `contextvars.copy_context().run`, like in a thread pool,
+    see the values of the caller.
     """
 
     _instances = set()
@@ -1273,80 +1304,150 @@ class ThreadedDict(threadlocal):
 
     def clear_all():
         """Clears all ThreadedDict instances."""
-        for t in list(ThreadedDict._instances):
-            t.clear()
+        values = _context_values.get()
+        if values is None and not ThreadedDict._use_context:
+            for t in list(ThreadedDict._instances):
+                t.clear()
+            return
+
+        # the values kept per context are dropped at once, only the instances
+        # releasing something when cleared are cleared.
+        for t in list(values or ()):
+            if type(t).clear is not ThreadedDict.clear:
+                t.clear()
+        _context_values.set({})
 
     clear_all = staticmethod(clear_all)
 
+    """True when values are kept per context in every thread, see use_contextvars."""
+    _use_context = False
+
+    def use_contextvars():
+        """Keeps the values of all ThreadedDict instances per context instead of
+        per thread, in every thread.
+
+        This is meant to be called once at startup, before handling requests.
+        """
+        ThreadedDict.clear_all()
+        ThreadedDict._use_context = True
+
+    use_contextvars = staticmethod(use_contextvars)
+
+    def use_context():
+        """Keeps the values of all ThreadedDict instances in the current context
+        instead of per thread, starting with no values. That applies to the
+        copies of the context made from now on, like the one of an asyncio task
+        started from here, but not to the other contexts and threads.
+        """
+        # clears the values of this thread too, they would hide those of the context.
+        ThreadedDict.clear_all()
+        _context_values.set({})
+
+    use_context = staticmethod(use_context)
+
+    def _values(self):
+        """Returns the dict holding the values: the thread local `__dict__`,
+        or a dict of the current context if values are kept per context.
+        """
+        values = _context_values.get()
+        if values is None:
+            if not ThreadedDict._use_context:
+                return self.__dict__
+            values = {}
+            _context_values.set(values)
+        d = values.get(self)
+        if d is None:
+            d = values[self] = {}
+        return d
+
     # Define all these methods to more or less fully emulate dict -- attribute access
-    # is built into threading.local.
+    # is built into threading.local, and only falls back to __getattr__ for the
+    # values kept per context.
+
+    def __getattr__(self, key):
+        try:
+            return self._values()[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        self._values()[key] = value
+
+    def __delattr__(self, key):
+        try:
+            del self._values()[key]
+        except KeyError:
+            raise AttributeError(key)
 
     def __getitem__(self, key):
-        return self.__dict__[key]
+        return self._values()[key]
 
     def __setitem__(self, key, value):
-        self.__dict__[key] = value
+        self._values()[key] = value
 
     def __delitem__(self, key):
-        del self.__dict__[key]
+        del self._values()[key]
 
     def __contains__(self, key):
-        return key in self.__dict__
+        return key in self._values()
 
     has_key = __contains__
 
     def clear(self):
-        self.__dict__.clear()
+        self._values().clear()
 
     def copy(self):
-        return self.__dict__.copy()
+        return self._values().copy()
 
     def get(self, key, default=None):
-        return self.__dict__.get(key, default)
+        return self._values().get(key, default)
 
     def items(self):
-        return self.__dict__.items()
+        return self._values().items()
 
     def iteritems(self):
-        return iteritems(self.__dict__)
+        return iteritems(self._values())
 
     def keys(self):
-        return self.__dict__.keys()
+        return self._values().keys()
 
     def iterkeys(self):
         try:
-            return iterkeys(self.__dict__)
+            return iterkeys(self._values())
         except NameError:
-            return self.__dict__.keys()
+            return self._values().keys()
 
     iter = iterkeys
 
     def values(self):
-        return self.__dict__.values()
+        return self._values().values()
 
     def itervalues(self):
-        return itervalues(self.__dict__)
+        return itervalues(self._values())
 
     def pop(self, key, *args):
-        return self.__dict__.pop(key, *args)
+        return self._values().pop(key, *args)
 
     def popitem(self):
-        return self.__dict__.popitem()
+        return self._values().popitem()
 
     def setdefault(self, key, default=None):
-        return self.__dict__.setdefault(key, default)
+        return self._values().setdefault(key, default)
 
     def update(self, *args, **kwargs):
-        self.__dict__.update(*args, **kwargs)
+        self._values().update(*args, **kwargs)
 
     def __repr__(self):
-        return "<ThreadedDict %r>" % self.__dict__
+        return "<ThreadedDict %r>" % self._values()
 
     __str__ = __repr__
 
 
 threadeddict = ThreadedDict
 
+# values of the ThreadedDicts kept per context: {ThreadedDict: dict}
+_context_values = contextvars.ContextVar("webpy_context_values", default=None)
+
 
 def autoassign(self, locals):
     """
@@ -3,6 +3,7 @@ Web API (wrapper around WSGI)
 (from web.py)
 """
 
+import os
 import pprint
 import sys
 import urllib
@@ -11,7 +12,15 @@ from urllib.parse import parse_qs, quote, unquote, urljoin
 
 import multipart
 
-from .utils import dictadd, intget, safestr, storage, storify, threadeddict
+from .utils import (
+    ThreadedDict,
+    dictadd,
+    intget,
+    lstrips,
+    safestr,
+    storage,
+    storify,
+)
 
 __all__ = [
     "config",
@@ -19,6 +28,8 @@ __all__ = [
     "debug",
     "input",
     "data",
+    "body_stream",
+    "body_into",
     "setcookie",
     "cookies",
     "ctx",
@@ -53,6 +64,7 @@ __all__ = [
     "Conflict",
     "Gone",
     "PreconditionFailed",
+    "PayloadTooLarge",
     "UnsupportedMediaType",
     "UnavailableForLegalReasons",
     "badrequest",
@@ -64,6 +76,7 @@ __all__ = [
     "conflict",
     "gone",
     "preconditionfailed",
+    "payloadtoolarge",
     "unsupportedmediatype",
     "unavailableforlegalreasons",
     # 500
@@ -77,8 +90,54 @@ A configuration object for various aspects of web.py.
 
 `debug`
    : when True, enables reloading, disabled template caching and sets internalerror to debugerror.
+
+`max_body_size`
+   : the maximum size of a request body in bytes, if set. Reading a bigger body
+     with `data`, `body_stream`, `body_into` or `input` raises `413 Payload Too Large`.
+
+`multipart_parameters`
+   : limits for parsing `multipart/form-data` bodies in `input`. The ones left
+     as None use the defaults of the `multipart` library.
+
+     - `part_limit`: the maximum number of parts.
+     - `partsize_limit`: the maximum size of a single part.
+     - `spool_limit`: parts bigger than this are written to a temporary file
+       instead of being kept in memory. File uploads come back as objects with
+       a `file` attribute that can be copied with `shutil.copyfileobj`, when
+       `input` is called with a `{}` default for them.
+     - `memory_limit`: the maximum size of all the parts kept in memory.
+     - `disk_limit`: the maximum size of all the parts written to disk.
+
+     When any of these is set, a body going over a limit gets a
+     `413 Payload Too Large` response and a malformed one a `400 Bad Request`.
+
+`template_cache_dir`
+   : when set, compiled templates are saved in this directory and loaded from
+     it by the next processes, instead of being compiled again. See
+     `web.template.BytecodeCache`.
+
+`debug_sql`
+   : when True, the database queries are printed to `web.debug` with their
+     duration. Defaults to `debug`.
+
+`slow_query_threshold`
+   : when set, database queries that take this many seconds or more are
+     printed to `web.debug`.
+
+`n_plus_one_threshold`
+   : when set, a database query made this many times in a request, with
+     the same or different values, is printed to `web.debug` as a likely N+1
+     query.
 """
 
+config.multipart_parameters = storage(
+    part_limit=None,
+    partsize_limit=None,
+    spool_limit=None,
+    memory_limit=None,
+    disk_limit=None,
+)
+
 
 class HTTPError(Exception):
     def __init__(self, status, headers={}, data=""):
@@ -320,6 +379,20 @@ class PreconditionFailed(HTTPError):
 preconditionfailed = PreconditionFailed
 
 
+class PayloadTooLarge(HTTPError):
+    """`413 Payload Too Large` error."""
+
+    message = "payload too large"
+
+    def __init__(self, message=None):
+        status = "413 Payload Too Large"
+        headers = {"Content-Type": "text/html"}
+        HTTPError.__init__(self, status, headers, message or self.message)
+
+
+payloadtoolarge = PayloadTooLarge
+
+
 class UnsupportedMediaType(HTTPError):
     """`415 Unsupported Media Type` error."""
 
@@ -401,56 +474,88 @@ def header(hdr, value, unique=False):
     ctx.headers.append((hdr, value))
 
 
-def rawinput(method=None):
-    """Returns storage object with GET or POST arguments."""
-    method = method or "both"
+def _process_values(values):
+    if isinstance(values, list):
+        return [_process_values(x) for x in values]
+    elif hasattr(values, "filename") and values.filename is None:
+        return values.value
+    else:
+        return values
+
+
+def _get_input():
+    """Returns the parsed query string, parsing it at most once per request."""
+    query = ctx.env.get("QUERY_STRING", "")
+    cached = ctx.get("_get_input")
+    if cached is None or cached[0] != query:
+        get_req = urllib.parse.parse_qs(query, keep_blank_values=True)
+        cached = ctx._get_input = (
+            query,
+            {k: _process_values(v) for k, v in get_req.items()},
+        )
+    return cached[1]
+
+
+def _post_input():
+    """Returns the parsed request body, parsing it at most once per request."""
+    if "_post_input" in ctx:
+        return ctx._post_input
+
+    env = ctx.env
+    if env.get("CONTENT_TYPE", "").lower().startswith("multipart/"):
+        # since wsgi.input is directly passed to multipart,
+        # it can not be called multiple times. Saving the result
+        # object in ctx to allow calling web.input multiple times.
+        post_req = ctx.get(
+            "_fieldstorage"
+        )  # TODO: Rename? is this visible anywhere else?
+        if not post_req:
+            _check_body_size(intget(env.get("CONTENT_LENGTH"), 0))
+            limits = {
+                k: v
+                for k, v in (config.get("multipart_parameters") or {}).items()
+                if v is not None
+            }
+            try:
+                # This returns two dicts, forms & files.
+                # Errors are ignored, as before, unless limits are set.
+                forms, files = multipart.parse_form_data(
+                    environ=env.copy(), ignore_errors=not limits, **limits
+                )
+                post_req = dictadd(forms, files)
+                ctx._fieldstorage = post_req
+            except multipart.ParserLimitReached:
+                raise payloadtoolarge()
+            except multipart.MultipartError:
+                raise badrequest()
+            except IndexError:
+                post_req = {}
+    else:
+        post_data = data().decode("utf-8")
+        post_req = parse_qs(post_data, keep_blank_values=True)
 
-    def dictify(fs):
-        return {k: fs[k] for k in fs}
+    ctx._post_input = {k: _process_values(post_req[k]) for k in post_req}
+    return ctx._post_input
 
-    env = ctx.env.copy()
-    post_req = get_req = {}
 
-    if method.lower() in ["both", "post", "put", "patch"]:
-        if env["REQUEST_METHOD"] in ["POST", "PUT", "PATCH"]:
-            if env.get("CONTENT_TYPE", "").lower().startswith("multipart/"):
-                # since wsgi.input is directly passed to multipart,
-                # it can not be called multiple times. Saving the result
-                # object in ctx to allow calling web.input multiple times.
-                post_req = ctx.get(
-                    "_fieldstorage"
-                )  # TODO: Rename? is this visible anywhere else?
-                if not post_req:
-                    try:
-                        # This returns two dicts, forms & files.
-                        forms, files = multipart.parse_form_data(environ=env)
-                        post_req = dictadd(forms, files)
-                        ctx._fieldstorage = post_req
-                    except IndexError:
-                        post_req = {}
+def rawinput(method=None):
+    """Returns storage object with GET or POST arguments.
 
-            else:
-                post_data = data().decode("utf-8")
-                post_req = parse_qs(post_data, keep_blank_values=True)
-            post_req = dictify(post_req)
-
-    if method.lower() in ["both", "get"]:
-        env["REQUEST_METHOD"] = "GET"
-        get_req = dict(
-            urllib.parse.parse_qs(env.get("QUERY_STRING", ""), keep_blank_values=True)
-        )
+    The arguments are parsed only on the first call in a request.
+    """
+    method = (method or "both").lower()
+    post_req = get_req = {}
 
-    def process_values(values):
-        if isinstance(values, list):
-            return [process_values(x) for x in values]
-        elif hasattr(values, "filename") and values.filename is None:
-            return values.value
-        else:
-            return values
+    if method in ["both", "post", "put", "patch"]:
+        if ctx.env["REQUEST_METHOD"] in ["POST", "PUT", "PATCH"]:
+            post_req = _post_input()
 
-    return storage(
-        [(k, process_values(v)) for k, v in dictadd(get_req, post_req).items()]
-    )
+    if method in ["both", "get"]:
+        get_req = _get_input()
+
+    if not post_req:
+        return storage(get_req)
+    return storage(dictadd(get_req, post_req))
 
 
 def input(*requireds, **defaults):
@@ -459,6 +564,14 @@ def input(*requireds, **defaults):
     See `storify` for how `requireds` and `defaults` work.
     """
     _method = defaults.pop("_method", "both")
+    if not requireds and not defaults:
+        # the common `web.input()` call, computed only once per request.
+        key = (_method, ctx.env.get("QUERY_STRING", ""))
+        cache = ctx.setdefault("_input_cache", {})
+        if key not in cache:
+            cache[key] = storify(rawinput(_method), _unicode=True)
+        return storage(cache[key])
+
     out = rawinput(_method)
     try:
         defaults.setdefault("_unicode", True)  # force unicode conversion by default.
@@ -467,17 +580,90 @@ def input(*requireds, **defaults):
         raise badrequest()
 
 
+def _check_body_size(size):
+    max_size = config.get("max_body_size")
+    if max_size is not None and size > max_size:
+        raise payloadtoolarge()
+
+
 def data():
     """Returns the data sent with the request."""
     if "data" not in ctx:
         if ctx.env.get("HTTP_TRANSFER_ENCODING") == "chunked":
-            ctx.data = ctx.env["wsgi.input"].read()
+            if config.get("max_body_size") is None:
+                ctx.data = ctx.env["wsgi.input"].read()
+            else:
+                ctx.data = b"".join(body_stream())
         else:
             cl = intget(ctx.env.get("CONTENT_LENGTH"), 0)
+            _check_body_size(cl)
             ctx.data = ctx.env["wsgi.input"].read(cl)
     return ctx.data
 
 
+def body_stream(chunk_size=64 * 1024):
+    """
+    Yields the data sent with the request in chunks of at most `chunk_size`
+    bytes, without reading all of it in memory.
+
+    The body can be read only once, either with `body_stream`, `body_into` or
+    `data`. If `data` has already been called, its result is used.
+    """
+    if "data" in ctx:
+        for i in range(0, len(ctx.data), chunk_size):
+            yield ctx.data[i : i + chunk_size]
+        return
+
+    f = ctx.env["wsgi.input"]
+    if ctx.env.get("HTTP_TRANSFER_ENCODING") == "chunked":
+        size = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            _check_body_size(size)
+            yield chunk
+    else:
+        remaining = intget(ctx.env.get("CONTENT_LENGTH"), 0)
+        _check_body_size(remaining)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def body_into(f, chunk_size=64 * 1024):
+    """
+    Writes the data sent with the request to the file object `f`, a chunk at
+    a time, and returns the number of bytes written. See `body_stream`.
+    """
+    readinto = getattr(ctx.env["wsgi.input"], "readinto", None)
+    chunked = ctx.env.get("HTTP_TRANSFER_ENCODING") == "chunked"
+
+    size = 0
+    if readinto is None or chunked or "data" in ctx:
+        for chunk in body_stream(chunk_size):
+            f.write(chunk)
+            size += len(chunk)
+        return size
+
+    # read into a single buffer, instead of allocating one for every chunk.
+    remaining = intget(ctx.env.get("CONTENT_LENGTH"), 0)
+    _check_body_size(remaining)
+    buf = memoryview(bytearray(min(chunk_size, remaining)))
+    while remaining > 0:
+        n = readinto(buf[: min(chunk_size, remaining)])
+        if not n:
+            break
+        f.write(buf[:n])
+        remaining -= n
+        size += n
+    return size
+
+
 def setcookie(
     name,
     value,
@@ -606,7 +792,174 @@ def _debugwrite(x):
 
 debug.write = _debugwrite
 
-ctx = context = threadeddict()
+
+def _env_protocol(env):
+    if env.get("wsgi.url_scheme") in ["http", "https"]:
+        return env["wsgi.url_scheme"]
+    elif env.get("HTTPS", "").lower() in ["on", "true", "1"]:
+        return "https"
+    else:
+        return "http"
+
+
+def _env_homepath(env):
+    return os.environ.get("REAL_SCRIPT_NAME", env.get("SCRIPT_NAME", ""))
+
+
+def _env_homedomain(env):
+    return _env_protocol(env) + "://" + env.get("HTTP_HOST", "[unknown]")
+
+
+def _env_home(env):
+    return _env_homedomain(env) + _env_homepath(env)
+
+
+def _env_path(env):
+    # http://trac.lighttpd.net/trac/ticket/406 requires:
+    if env.get("SERVER_SOFTWARE", "").startswith(("lighttpd/", "nginx/")):
+        path = lstrips(env.get("REQUEST_URI").split("?")[0], _env_homepath(env))
+        # Apache and CherryPy webservers unquote urls but lighttpd and nginx do not.
+        # Unquote explicitly for lighttpd and nginx to make ctx.path uniform across
+        # all servers.
+        return unquote(path)
+
+    try:
+        return bytes(env.get("PATH_INFO"), "latin1").decode("utf8")
+    except UnicodeDecodeError:  # If there are Unicode characters...
+        return env.get("PATH_INFO")
+
+
+def _env_query(env):
+    if env.get("QUERY_STRING"):
+        return "?" + env.get("QUERY_STRING", "")
+    else:
+        return ""
+
+
+def _env_fullpath(env):
+    return _env_path(env) + _env_query(env)
+
+
+class _Context(ThreadedDict):
+    """
+    Type of `ctx`. Values derived from the request environ that handlers
+    rarely need are computed on first access, instead of for every request
+    in `application.load`, and are stored in the ctx after that.
+
+        >>> c = _Context()
+        >>> c.environ = {"HTTP_HOST": "example.com", "PATH_INFO": "/a"}
+        >>> c.home
+        'http://example.com'
+        >>> c["fullpath"]
+        '/a'
+        >>> c.home = c.home + "/blog"
+        >>> c.home, c.realhome
+        ('http://example.com/blog', 'http://example.com')
+    """
+
+    # name -> function to compute the value from the environ.
+    # @@ `home` is changed when the request is handled to a sub-application,
+    # @@ but `realhome`, the real home, is required for doing absolute redirects.
+    lazy = {
+        "homedomain": _env_homedomain,
+        "home": _env_home,
+        "realhome": _env_home,
+        "query": _env_query,
+        "fullpath": _env_fullpath,
+    }
+
+    def _compute(self, key):
+        env = super().get("environ")
+        if env is None or key not in self.lazy:
+            raise KeyError(key)
+        value = self.lazy[key](env)
+        super().__setitem__(key, value)
+        return value
+
+    def _compute_all(self):
+        if super().__contains__("environ"):
+            for key in self.lazy:
+                if not super().__contains__(key):
+                    self._compute(key)
+
+    def __getattr__(self, key):
+        # called only when key is not an attribute of the ctx already.
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __getitem__(self, key):
+        try:
+            return super().__getitem__(key)
+        except KeyError:
+            return self._compute(key)
+
+    def __contains__(self, key):
+        if super().__contains__(key):
+            return True
+        return key in self.lazy and super().__contains__("environ")
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *args):
+        if key in self:
+            self[key]
+        return super().pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        return super().setdefault(key, default)
+
+    def copy(self):
+        self._compute_all()
+        return super().copy()
+
+    def items(self):
+        self._compute_all()
+        return super().items()
+
+    def iteritems(self):
+        self._compute_all()
+        return super().iteritems()
+
+    def keys(self):
+        self._compute_all()
+        return super().keys()
+
+    def iterkeys(self):
+        self._compute_all()
+        return super().iterkeys()
+
+    iter = iterkeys
+
+    def values(self):
+        self._compute_all()
+        return super().values()
+
+    def itervalues(self):
+        self._compute_all()
+        return super().itervalues()
+
+    def popitem(self):
+        self._compute_all()
+        return super().popitem()
+
+    def __repr__(self):
+        self._compute_all()
+        return super().__repr__()
+
+    __str__ = __repr__
+
+
+ctx = context = _Context()
 
 ctx.__doc__ = """
 A `storage` object containing various information about the request:
@@ -619,6 +972,8 @@ A `storage` object containing various information about the request:
 
 `home`
    : The base path for the application.
+     It is computed from `environ` on first access, as are `homedomain`,
+     `realhome`, `query` and `fullpath`.
 
 `ip`
    : The IP address of the requester.